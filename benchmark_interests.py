@@ -0,0 +1,73 @@
+#! /usr/bin/env python3
+'''
+Microbenchmark for NewsBot.isTopicOfInterest: the precompiled
+InterestMatcher against the former regex-per-term implementation.
+'''
+import argparse
+import re
+import sys
+import timeit
+import linuxbrnewsgenerator as lxbr
+
+sys.dont_write_bytecode = True
+
+# same titles used in test_linuxbrnewsgenerator.py
+TITLES = [
+    "Smart Lasers for Bone Surgery",
+    "Hasura V3 Engine is in alpha",
+    "He Stole Hundreds of iPhones and Looted People's Life Savings. He Told Us How",
+    "Python Testing Essentials: A Comprehensive Guide",
+    "Show HN: ClimateTriage – Impactful open source contributions",
+    "Gemini: A Family of Highly Capable Multimodal Models",
+    "Notesnook – open-source and zero knowledge private note taking app",
+    "Das Schiff Is a GitOps Based Kubernetes Cluster as a Service Platform",
+]
+
+def legacy_match(terms : list, text : str) -> list:
+    'The implementation used before InterestMatcher'
+    words_of_interest = []
+    for word in terms:
+        if re.search(r"[ \.,]" + word.lower() + r"[ \.,]", text.lower()):
+            words_of_interest.append(word)
+        elif re.search(r"[ \.,]" + word.lower() + "$", text.lower()):
+            words_of_interest.append(word)
+        elif re.search("^" + word.lower() + r"[ \.,]", text.lower()):
+            words_of_interest.append(word)
+    return words_of_interest
+
+def synthetic_terms(size : int) -> list:
+    'Grow the interests list with made up terms up to size'
+    terms = list(lxbr.INTERESTED_TERMS)
+    index = 0
+    while len(terms) < size:
+        terms.append(f"term{index}")
+        index += 1
+    return terms
+
+def bench(terms : list, repeat : int):
+    'Run both implementations over TITLES and print the timings'
+    matcher = lxbr.InterestMatcher(terms)
+    for title in TITLES:
+        if matcher.match(title) != legacy_match(terms, title):
+            raise Exception(f'Results differ for: {title}') # pylint: disable=W0719
+
+    legacy = timeit.timeit(
+        lambda: [ legacy_match(terms, title) for title in TITLES ], number=repeat)
+    current = timeit.timeit(
+        lambda: [ matcher.match(title) for title in TITLES ], number=repeat)
+    per_title = len(TITLES) * repeat
+    print(f'{len(terms):6d} terms: legacy {legacy / per_title * 1e6:10.1f} us/title, '
+        f'matcher {current / per_title * 1e6:8.1f} us/title, '
+        f'speedup {legacy / current:6.1f}x')
+
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser(description='isTopicOfInterest microbenchmark')
+    parse.add_argument('--repeat', type=int, default=5, help="rounds over the titles")
+    parse.add_argument('--sizes', default="0,1000,5000",
+        help="interests list sizes (0 means interests.list as it is)")
+    args = parse.parse_args()
+
+    lxbr.get_interested_terms()
+    for size in args.sizes.split(","):
+        bench(synthetic_terms(int(size)), args.repeat)
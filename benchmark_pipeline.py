@@ -0,0 +1,226 @@
+#! /usr/bin/env python3
+'''
+Offline benchmark of the whole pipeline.  A local http server plays the
+HN feed, the article pages, their images and the WordPress REST API, and
+translations go to a stub backend, so no real service is used.
+
+It measures isTopicOfInterest, generate_summary,
+get_article_content_and_image and a full NewsBot.run() at several
+scales (number of articles in the feed).
+
+The NLTK data must be installed (linuxbrnewsgenerator.py --prepare).
+'''
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import linuxbrnewsgenerator as lxbr
+
+sys.dont_write_bytecode = True
+
+WORDS = ("linux kernel release driver memory scheduler patch developers performance "
+    "filesystem network security update support hardware users project community "
+    "version code change system process open source feature bug fix test").split()
+
+IMAGES = 5
+
+def article_text(index : int, paragraphs : int = 12) -> list:
+    'Deterministic paragraphs of made up text for an article'
+    rnd = random.Random(index)
+    text = []
+    for _ in range(paragraphs):
+        sentences = []
+        for _ in range(rnd.randint(3, 6)):
+            words = [ rnd.choice(WORDS) for _ in range(rnd.randint(8, 25)) ]
+            sentences.append(" ".join(words).capitalize() + ".")
+        text.append(f"Article {index}: " + " ".join(sentences))
+    return text
+
+def article_title(index : int) -> str:
+    'Half of the titles are of interest'
+    if index % 2 == 0:
+        return f"Linux kernel {index} released with new features"
+    return f"Smart lasers for bone surgery, part {index}"
+
+class FixtureServer(BaseHTTPRequestHandler):
+    'HN feed, articles, images and a fake WordPress'
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes: no 40ms delayed ack per response
+    disable_nagle_algorithm = True
+    articles = 10
+    next_id = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args): # pylint: disable=W0622
+        pass
+
+    def reply(self, body : bytes, content_type : str, status : int = 200):
+        'Send a response with its length (keep-alive)'
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def new_id(self) -> int:
+        'Ids of the created media and posts'
+        with self.lock:
+            FixtureServer.next_id += 1
+            return FixtureServer.next_id
+
+    def do_GET(self): # pylint: disable=C0103
+        'Feed, pages, images and the media/posts lists'
+        host = f"http://{self.headers['Host']}"
+        if self.path == "/newest":
+            items = "".join(
+                f"<item><title>{article_title(index)}</title>"
+                f"<link>{host}/article/{index}</link></item>"
+                for index in range(self.articles))
+            self.reply(("<?xml version='1.0'?><rss version='2.0'><channel><title>HN</title>"
+                f"{items}</channel></rss>").encode(), "application/rss+xml")
+        elif self.path.startswith(("/wp/wp-json/wp/v2/media", "/wp/wp-json/wp/v2/posts")):
+            self.reply(b"[]", "application/json")
+        elif re.match(r"^/article/\d+$", self.path):
+            index = int(self.path.split("/")[-1])
+            paragraphs = "".join(f"<p>{paragraph}</p>" for paragraph in article_text(index))
+            self.reply((f"<html><head><title>{article_title(index)}</title>"
+                f"<meta property='og:image' content='/image/{index % IMAGES}.gif'></head>"
+                "<body><nav><p>menu</p></nav>"
+                f"<article><h1>{article_title(index)}</h1>{paragraphs}</article>"
+                + "<footer><p>footer</p></footer>" * 50 +
+                "</body></html>").encode(), "text/html; charset=utf-8")
+        elif re.match(r"^/image/\d+\.gif$", self.path):
+            index = int(re.findall(r"\d+", self.path)[0])
+            self.reply(b"GIF89a" + bytes([index]) * 20000, "image/gif")
+        else:
+            self.reply(b"not found", "text/plain", 404)
+
+    def do_POST(self): # pylint: disable=C0103
+        'Media uploads and posts'
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path in ("/wp/wp-json/wp/v2/media", "/wp/wp-json/wp/v2/posts"):
+            self.reply(json.dumps({"id": self.new_id()}).encode(), "application/json", 201)
+        else:
+            self.reply(b"not found", "text/plain", 404)
+
+class StubTranslator:
+    'Offline translation backend'
+    def translate(self, texts : list, src : str, dest : str) -> list:
+        'Pretend to translate'
+        return [ f"[{dest}] {text}" for text in texts ]
+
+def start_server():
+    'The fixture server in a background thread'
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureServer)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def new_bot(base_url : str, workdir : str) -> lxbr.NewsBot:
+    'A NewsBot pointing to the fixture server, with its stores in workdir'
+    config = os.path.join(workdir, "bench.config")
+    with open(config, "w", encoding="utf-8") as dst:
+        dst.write(f"[WORDPRESS]\nSITE = {base_url}/wp\nTOKEN = bench\n\n"
+            f"[CACHE]\nDIRECTORY = {workdir}\n")
+    bot = lxbr.NewsBot(config)
+    bot.translator = lxbr.TranslationService(StubTranslator(), bot.translator.cache)
+    return bot
+
+def latency(samples : list) -> dict:
+    'Summary of a list of durations in seconds'
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'count' : len(samples),
+        'per_second' : len(samples) / total if total else 0.0,
+        'mean_ms' : statistics.mean(samples) * 1000,
+        'p50_ms' : samples[len(samples) // 2] * 1000,
+        'p95_ms' : samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+    }
+
+def timed(function, items : list) -> dict:
+    'Call function for each item and summarize the durations'
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        samples.append(time.perf_counter() - start)
+    return latency(samples)
+
+def bench(scale : int, base_url : str) -> dict:
+    'All the measurements for a feed with scale articles'
+    FixtureServer.articles = scale
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = new_bot(base_url, workdir)
+        titles = [ article_title(index) for index in range(scale) ]
+        results['isTopicOfInterest'] = timed(bot.isTopicOfInterest, titles)
+        texts = [ "\n".join(article_text(index)) for index in range(scale) ]
+        results['generate_summary'] = timed(bot.generate_summary, texts)
+        links = [ f"{base_url}/article/{index}" for index in range(scale) ]
+        results['get_article_content_and_image'] = timed(bot.get_article_content_and_image, links)
+        bot.close()
+
+    lxbr.HACKERNEWS_FEED = f"{base_url}/newest"
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = new_bot(base_url, workdir)
+        start = time.perf_counter()
+        bot.run()
+        seconds = time.perf_counter() - start
+        report = bot.stats.report()
+        bot.close()
+    results['run'] = {
+        'seconds' : seconds,
+        'articles_per_second' : scale / seconds,
+        'phases' : report['phases'],
+        'counters' : report['counters'],
+    }
+    return results
+
+def print_results(scale : int, results : dict):
+    'Human readable output'
+    print(f"== {scale} articles")
+    for name in ('isTopicOfInterest', 'generate_summary', 'get_article_content_and_image'):
+        values = results[name]
+        print(f"  {name:30s} {values['per_second']:10.1f}/s  mean {values['mean_ms']:8.2f} ms"
+            f"  p50 {values['p50_ms']:8.2f} ms  p95 {values['p95_ms']:8.2f} ms")
+    run = results['run']
+    print(f"  {'NewsBot.run':30s} {run['articles_per_second']:10.1f}/s  total {run['seconds']:.2f} s"
+        f"  posted {run['counters'].get('publish_posted', 0)}")
+    for phase, values in run['phases'].items():
+        print(f"    {phase:28s} {values['seconds']:8.3f} s in {values['calls']} calls")
+
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser(description='Offline benchmark of the news pipeline')
+    parse.add_argument('--scales', default="10,100,1000", help="articles in the feed")
+    parse.add_argument('--json', help="also save the results to this json file")
+    args = parse.parse_args()
+
+    lxbr.logger.setLevel(logging.WARNING)
+    lxbr.get_interested_terms()
+    try:
+        lxbr.SUMMARIZER.load(download=False)
+    except LookupError:
+        print("ERROR: NLTK data not found, run: ./linuxbrnewsgenerator.py --prepare")
+        sys.exit(1)
+
+    fixtures = start_server()
+    url = f"http://127.0.0.1:{fixtures.server_address[1]}"
+    all_results = {}
+    for size in [ int(size) for size in args.scales.split(",") ]:
+        all_results[size] = bench(size, url)
+        print_results(size, all_results[size])
+    fixtures.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(all_results, output, indent=4)
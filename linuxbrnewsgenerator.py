@@ -9,26 +9,119 @@ import time
 import mimetypes
 import sys
 import configparser
+import random
+import signal
+import codecs
+import hashlib
+import importlib.util
+import io
+import multiprocessing
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from html import unescape
+from html.parser import HTMLParser
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode, urljoin
+from collections import Counter
 from heapq import nlargest
-from nltk.tokenize import sent_tokenize
-from nltk.corpus import stopwords
-from nltk.probability import FreqDist
-import nltk
-from googletrans import Translator
+from itertools import islice
 import requests
-import feedparser
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 sys.dont_write_bytecode = True
 
+# default feed, when the config has no [FEED <name>] section
 HACKERNEWS_FEED = "https://hnrss.org/newest"
-
-translator = Translator(service_urls=['translate.google.com'])
+# seconds between two downloads of a feed (0: on every run)
+FEED_INTERVAL = 0
+# feeds downloaded in parallel (overridden by the [FETCH] config section)
+FEED_WORKERS = 8
+
+# concurrent article downloads (overridden by the [FETCH] config section)
+FETCH_WORKERS = 8
+FETCH_PER_HOST = 2
+# no article page is read beyond this size
+FETCH_MAX_HTML_BYTES = 2 * 1024 * 1024
+
+# shared HTTP session (overridden by the [HTTP] config section)
+HTTP_POOL_SIZE = 10
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+HTTP_SESSION = None
+
+# images bigger than this are not published (overridden by the [IMAGES] config section)
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+# optional downscaling/re-encoding before the upload (needs Pillow)
+IMAGE_PROCESS = False
+IMAGE_MAX_DIMENSION = 1200
+IMAGE_MIN_DIMENSION = 100
+IMAGE_FORMAT = 'WEBP'
+IMAGE_QUALITY = 80
+IMAGE_WORKERS = 2
+
+# worker processes parsing and summarizing the articles, so it uses all
+# the cores (overridden by the [CPU] config section), 0: in the fetching
+# threads
+CPU_WORKERS = 0
+
+# uploaded images are named <name>-<first 16 chars of the content hash>.<ext>
+# and WordPress may add "-<number>" or "-scaled" to it
+MEDIA_HASH_SIZE = 16
+MEDIA_HASH_RE = re.compile(r"-([0-9a-f]{16})(?:-\d+)?(?:-scaled)?\.[A-Za-z0-9]+$")
+
+# simultaneous articles being published (overridden by the [PUBLISH] config section)
+PUBLISH_WORKERS = 4
+# failed posts are sent again from the outbox after RETRY_BACKOFF seconds,
+# doubling on each failure up to RETRY_MAX_BACKOFF, RETRY_MAX_ATTEMPTS times
+PUBLISH_RETRY_BACKOFF = 60
+PUBLISH_RETRY_MAX_BACKOFF = 6 * 3600
+PUBLISH_RETRY_MAX_ATTEMPTS = 10
+
+# publishWordPress() outcomes
+PUBLISH_POSTED = 'posted'
+PUBLISH_ALREADY_PUBLISHED = 'already_published'
+PUBLISH_MISSING_IMAGE = 'missing_image'
+PUBLISH_IMAGE_FAILED = 'image_failed'
+PUBLISH_FAILED = 'failed'
+PUBLISH_QUEUED = 'queued'
+
+# daemon mode polling (overridden by the [DAEMON] config section)
+DAEMON_INTERVAL = 60
+DAEMON_JITTER = 10
+
+# persistent caches and stores (overridden by the [CACHE] config section)
+CACHE_DIR = os.path.expanduser("~/.cache/linux-br.org-news-bot")
+# extracted article pages: kept for at most ARTICLE_CACHE_TTL seconds (or
+# less, by Cache-Control) and up to ARTICLE_CACHE_MAX_BYTES in total
+ARTICLE_CACHE_TTL = 6 * 3600
+ARTICLE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# near duplicate articles: MinHash (MINHASH_SIZE values) of the text
+# shingles (sequences of SHINGLE_SIZE words), searched with LSH
+# (MINHASH_BANDS bands of the signature).  The threshold is overridden by
+# the [DEDUP] config section.
+SHINGLE_SIZE = 5
+MINHASH_SIZE = 64
+MINHASH_BANDS = 16
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# translation (overridden by the [TRANSLATION] config section)
+TRANSLATION_CACHE_SIZE = 20000
+TRANSLATION_BATCH_CHARS = 4500
+
+# nltk, googletrans and feedparser are heavy to import, so they are
+# only imported when used (see prepare() to have them ready beforehand)
+NLTK_RESOURCES = [ 'punkt', 'stopwords' ]
 
 program_path = os.path.dirname(__file__)
 
 INTERESTED_TERMS = [ ]
 INTERESTED_TERMS_FILE = f"{program_path}/interests.list"
+INTEREST_MATCHER = None
 
 CORRECTIONS = {
     "ferrugem" : "rust",
@@ -45,41 +138,1500 @@ logger = logging.getLogger(scriptName)
 logger.setLevel('DEBUG')
 
 
+class InterestMatcher:
+    '''
+    All the interested terms compiled into a few regular expressions.
+    A term matches when it is surrounded by " ", "." or "," (or by the
+    beginning/end of the text, but not both).  Terms are bucketed by their
+    first character, so each word of a title is only tried against the
+    terms that could start there, instead of three searches per term.
+    '''
+    DELIMITERS = " .,"
+    # the end of text only counts as boundary if the term didn't start at the beginning
+    BOUNDARY = r"(?:[ .,]|(?(start)(?!)|$))"
+
+    def __init__(self, terms : list):
+        self.terms = list(terms)
+        buckets = {}
+        for index, term in enumerate(self.terms):
+            term = term.lower()
+            buckets.setdefault(self.first_char(term), []).append((index, term))
+        self.buckets = {
+            char: self.compile(indexed_terms) for char, indexed_terms in buckets.items()
+        }
+        # terms starting with a regex construct may start with any character
+        self.wildcard = self.buckets.pop(None, None)
+
+    @staticmethod
+    def first_char(term : str):
+        'The literal first character of a term or None if it is not known'
+        if not term or not term[0].isalnum():
+            return None
+        if len(term) > 1 and term[1] in "?*{":
+            return None
+        if InterestMatcher.has_alternation(term):
+            # "a|b" may also start with b
+            return None
+        return term[0]
+
+    @staticmethod
+    def has_alternation(term : str) -> bool:
+        'True if the term has a "|" outside of groups and character classes'
+        depth = 0
+        in_class = False
+        escaped = False
+        for char in term:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif in_class:
+                in_class = char != "]"
+            elif char == "[":
+                in_class = True
+            elif char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            elif char == "|" and depth == 0:
+                return True
+        return False
+
+    def compile(self, indexed_terms : list) -> tuple:
+        '''
+        One pattern for a group of terms, where each term has its own
+        (optional) lookahead capture, so overlapping terms are all found.
+        '''
+        any_term = "|".join(f"(?:{term})" for _, term in indexed_terms)
+        captures = "".join(
+            f"(?:(?=(?P<t{index}>{term}){self.BOUNDARY})|)"
+            for index, term in indexed_terms
+        )
+        pattern = re.compile(
+            r"(?:(?<=[ .,])|(?P<start>\A))" +
+            f"(?=(?:{any_term}){self.BOUNDARY})" +
+            captures
+        )
+        groups = [
+            (index, pattern.groupindex[f"t{index}"] - 1) for index, _ in indexed_terms
+        ]
+        return (pattern, groups)
+
+    def match(self, text : str) -> list:
+        'Return the terms found in the text, in the same order of the terms list'
+        text = text.lower()
+        found = set()
+        positions = [0] + [
+            pos + 1 for pos, char in enumerate(text) if char in self.DELIMITERS
+        ]
+        for pos in positions:
+            for bucket in (self.buckets.get(text[pos:pos + 1]), self.wildcard):
+                if bucket is None:
+                    continue
+                pattern, groups = bucket
+                match = pattern.match(text, pos)
+                if match is None:
+                    continue
+                captured = match.groups()
+                found.update(index for index, group in groups if captured[group] is not None)
+        return [ self.terms[index] for index in sorted(found) ]
+
+
 def get_interested_terms():
     'to populated to interested terms'
-    global INTERESTED_TERMS
+    global INTEREST_MATCHER # pylint: disable=W0603
+    terms = []
     with open(INTERESTED_TERMS_FILE, encoding="utf-8") as src:
         for line in src.readlines():
-            INTERESTED_TERMS.append(line.rstrip())
-
-def getHtmlContent(link : str) -> str: # pylint: disable=C0103
-    'To fetch html content and return the text'
-    response = requests.get(link, timeout=10)
-    return response.text
-
-def getImageExtension(image_line: str) -> str: # pylint: disable=C0103
-    'To figure out the image extension name'
-    imgType =  mimetypes.guess_type(image_line)[0] # pylint: disable=C0103
-    if imgType == "svg+xml":
-        imgType = "svg" # pylint: disable=C0103
-    return imgType
-
-def getImage(link : str): # pylint: disable=C0103
-    'To fetch an image from some url'
-    logger.debug('getimage() link: %s', link)
-    extension = getImageExtension(link)
-    if extension is None:
-        logger.debug('getImage(): %s is None', link)
+            terms.append(line.rstrip())
+    # compiled first: the current terms are kept if one is invalid
+    matcher = InterestMatcher(terms)
+    INTERESTED_TERMS[:] = terms
+    INTEREST_MATCHER = matcher
+
+def configure_http_session(pool_size : int = HTTP_POOL_SIZE, retries : int = HTTP_RETRIES,
+        backoff : float = HTTP_BACKOFF) -> requests.Session:
+    '''
+    Create the session shared by every outbound request, so connections
+    (and TLS handshakes) are reused between calls to the same host.
+    pool_size is also the maximum of connections kept per host.
+    '''
+    global HTTP_SESSION # pylint: disable=W0603
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # POST is not retried to not publish twice
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+        max_retries=retry, pool_block=True)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if HTTP_SESSION is not None:
+        HTTP_SESSION.close()
+    HTTP_SESSION = session
+    return session
+
+def get_http_session() -> requests.Session:
+    'The shared session, created with the defaults if not configured yet'
+    if HTTP_SESSION is None:
+        return configure_http_session()
+    return HTTP_SESSION
+
+def load_json(path : str, default):
+    'To read a json file, or return default if it does not exist or is broken'
+    try:
+        with open(path, encoding="utf-8") as src:
+            return json.load(src)
+    except FileNotFoundError:
+        return default
+    except ValueError:
+        logger.warning("Ignoring corrupted file: %s", path)
+        return default
+
+def save_text(path : str, text : str):
+    'To write a file atomically (no half written file if we crash)'
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as dst:
+        dst.write(text)
+    os.replace(tmp_path, path)
+
+def save_json(path : str, data):
+    'To write a json file atomically'
+    save_text(path, json.dumps(data))
+
+class RunStats:
+    '''
+    Telemetry of a run: time spent per phase and counters (bytes
+    transferred, cache hits, discard reasons...).  It is updated from the
+    fetching and publishing threads.
+    '''
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.phases = {}
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    def add_time(self, phase : str, seconds : float):
+        'Account seconds spent on phase'
+        with self.lock:
+            total, calls = self.phases.get(phase, (0.0, 0))
+            self.phases[phase] = (total + seconds, calls + 1)
+
+    @contextmanager
+    def timer(self, phase : str):
+        'Account the time spent in the block'
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def count(self, name : str, value : int = 1):
+        'Increment a counter'
+        with self.lock:
+            self.counters[name] += value
+
+    def finish(self):
+        'Mark the end of the run'
+        self.finished = time.time()
+
+    def report(self) -> dict:
+        'Everything as a dict (to be saved as json)'
+        with self.lock:
+            return {
+                'started' : self.started,
+                'finished' : self.finished,
+                'seconds' : (self.finished or time.time()) - self.started,
+                'phases' : {
+                    phase : { 'seconds' : total, 'calls' : calls }
+                    for phase, (total, calls) in sorted(self.phases.items())
+                },
+                'counters' : dict(sorted(self.counters.items()))
+            }
+
+    def prometheus(self, prefix : str = "newsbot") -> str:
+        'Everything in the Prometheus text format (for the node_exporter textfile collector)'
+        report = self.report()
+        lines = [
+            f"# HELP {prefix}_run_seconds Duration of the last run.",
+            f"# TYPE {prefix}_run_seconds gauge",
+            f"{prefix}_run_seconds {report['seconds']:.6f}",
+            f"# HELP {prefix}_last_run_timestamp_seconds When the last run started.",
+            f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+            f"{prefix}_last_run_timestamp_seconds {report['started']:.3f}",
+            f"# HELP {prefix}_phase_seconds Time spent per phase in the last run.",
+            f"# TYPE {prefix}_phase_seconds gauge",
+        ]
+        lines += [ f'{prefix}_phase_seconds{{phase="{phase}"}} {values["seconds"]:.6f}'
+            for phase, values in report['phases'].items() ]
+        lines += [
+            f"# HELP {prefix}_phase_calls Times each phase ran in the last run.",
+            f"# TYPE {prefix}_phase_calls gauge",
+        ]
+        lines += [ f'{prefix}_phase_calls{{phase="{phase}"}} {values["calls"]}'
+            for phase, values in report['phases'].items() ]
+        lines += [
+            f"# HELP {prefix}_events Counters of the last run.",
+            f"# TYPE {prefix}_events gauge",
+        ]
+        lines += [ f'{prefix}_events{{event="{name}"}} {value}'
+            for name, value in report['counters'].items() ]
+        return "\n".join(lines) + "\n"
+
+def streamHtmlContent(link : str, max_bytes : int = FETCH_MAX_HTML_BYTES, # pylint: disable=C0103
+        stats : RunStats = None, headers : dict = None, response_info : dict = None):
+    '''
+    To fetch html content, yielding the text as it arrives and stopping
+    at max_bytes.  The download is dropped when the caller stops reading.
+    The status and headers of the response are set in response_info.
+    '''
+    with get_http_session().get(link, timeout=10, stream=True, headers=headers) as response:
+        if response_info is not None:
+            response_info['status'] = response.status_code
+            response_info['headers'] = response.headers
+        if response.status_code == 304:
+            return
+        # text/html without charset would be latin-1 for requests
+        encoding = 'utf-8'
+        if 'charset' in response.headers.get('content-type', '').lower():
+            encoding = response.encoding
+        try:
+            decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        except LookupError:
+            # unknown charset (e.g. "utf8mb4"): most of these pages are utf-8
+            logger.debug('Unknown charset %s for %s, using utf-8', encoding, link)
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        received = 0
+        for chunk in response.iter_content(chunk_size=16 * 1024):
+            received += len(chunk)
+            if stats is not None:
+                stats.count('html_bytes', len(chunk))
+            yield decoder.decode(chunk)
+            if received >= max_bytes:
+                logger.info('Stopped reading %s at %d bytes', link, received)
+                return
+        yield decoder.decode(b'', final=True)
+
+class ArticleExtractor(HTMLParser):
+    '''
+    Incremental html parser that only keeps the paragraphs inside
+    <article> and the first usable image of the page (og:image, or the
+    first <img> src/srcset).  done is set once both are found, so the
+    rest of the page doesn't need to be read.
+    '''
+    def __init__(self, base_url : str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.paragraphs = []
+        self.image = None
+        self.done = False
+        self.article_depth = 0
+        self.article_seen = False
+        self.paragraph = None
+
+    def image_url(self, url : str) -> str:
+        'Absolute url of an image, None if it is not usable'
+        if not url:
+            return None
+        url = url.strip()
+        if not url or url.startswith('data:'):
+            return None
+        return urljoin(self.base_url, url)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'meta' and self.image is None and \
+                attrs.get('property', attrs.get('name')) == 'og:image':
+            self.image = self.image_url(attrs.get('content'))
+        elif tag == 'img' and self.image is None:
+            self.image = self.image_url(attrs.get('src'))
+            if self.image is None and attrs.get('srcset'):
+                # "image-1x.png 1x, image-2x.png 2x"
+                self.image = self.image_url(attrs['srcset'].split(',')[0].strip().split(' ')[0])
+        elif tag == 'article':
+            self.article_depth += 1
+            self.article_seen = True
+        elif tag == 'p' and self.article_depth > 0:
+            self.end_paragraph()
+            self.paragraph = []
+
+    def handle_endtag(self, tag):
+        if tag == 'p':
+            self.end_paragraph()
+        elif tag == 'article' and self.article_depth > 0:
+            self.end_paragraph()
+            self.article_depth -= 1
+        self.done = self.article_seen and self.article_depth == 0 and self.image is not None
+
+    def handle_data(self, data):
+        if self.paragraph is not None:
+            self.paragraph.append(data)
+
+    def end_paragraph(self):
+        'Keep the text of the current paragraph'
+        if self.paragraph is not None:
+            self.paragraphs.append(''.join(self.paragraph))
+            self.paragraph = None
+
+    def text(self) -> str:
+        'The paragraphs, each one starting with a new line'
+        self.end_paragraph()
+        return ''.join('\n' + paragraph for paragraph in self.paragraphs)
+
+class FeedCache:
+    '''
+    Persistent cache of RSS feeds.  It keeps the ETag/Last-Modified of the
+    last download together with the parsed entries, so the next download
+    is a conditional request and a "304 Not Modified" costs a single
+    cheap round-trip.
+    '''
+    def __init__(self, path : str):
+        self.path = path
+        self.feeds = load_json(path, {})
+        # feeds are downloaded in parallel
+        self.lock = threading.Lock()
+
+    def is_due(self, link : str, interval : int, now : float = None) -> bool:
+        'Was the last download of link at least interval seconds ago?'
+        if now is None:
+            now = time.time()
+        with self.lock:
+            checked = self.feeds.get(link, {}).get('checked', 0)
+        return now - checked >= interval
+
+    def conditional_headers(self, link : str) -> dict:
+        'The validators of the last download of link'
+        with self.lock:
+            cached = self.feeds.get(link, {})
+        headers = {}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('modified'):
+            headers['If-Modified-Since'] = cached['modified']
+        return headers
+
+    def fetch(self, link : str) -> tuple:
+        '''
+        Download the feed and return its entries (as title/link dicts) and
+        whether it changed since the last download.
+        '''
+        response = get_http_session().get(
+            link, headers=self.conditional_headers(link), timeout=10)
+        with self.lock:
+            if response.status_code == 304 and link in self.feeds:
+                logger.debug('feed not modified: %s', link)
+                self.feeds[link]['checked'] = time.time()
+                return (self.feeds[link]['entries'], False)
+
+        import feedparser # pylint: disable=C0415
+        fp = feedparser.parse(response.content,
+            response_headers={'content-type': response.headers.get('content-type', '')})
+        entries = [ { 'title' : e['title'], 'link' : e['link'] } for e in fp['entries'] ]
+        if response.status_code == 200:
+            with self.lock:
+                self.feeds[link] = {
+                    'etag' : response.headers.get('ETag'),
+                    'modified' : response.headers.get('Last-Modified'),
+                    'checked' : time.time(),
+                    'entries' : entries
+                }
+        return (entries, True)
+
+    def save(self):
+        'Persist the cache (only once the run is done, so a crash retries the feeds)'
+        with self.lock:
+            save_json(self.path, self.feeds)
+
+def cacheLifetime(headers, ttl : float) -> float: # pylint: disable=C0103
+    '''
+    Seconds a response can be used without asking the server again (up to
+    ttl), by its Cache-Control.  None when it must not be stored.
+    '''
+    directives = [ directive.strip().lower()
+        for directive in headers.get('Cache-Control', '').split(',') ]
+    if 'no-store' in directives:
+        return None
+    if 'no-cache' in directives:
+        return 0
+    for directive in directives:
+        if directive.startswith('max-age='):
+            try:
+                return min(ttl, max(0, int(directive[8:])))
+            except ValueError:
+                break
+    return ttl
+
+class ArticleCache:
+    '''
+    Persistent (sqlite) cache of the article pages, keyed by url.  It
+    keeps what was extracted (text and image urls), not the html, so a
+    retry skips both the download and the parsing.  Expired entries with
+    an ETag/Last-Modified are revalidated with a conditional request.  The
+    least recently used entries are evicted when the total size goes over
+    max_bytes.
+    It is used from the fetching threads.
+    '''
+    def __init__(self, path : str, ttl : float = ARTICLE_CACHE_TTL,
+            max_bytes : int = ARTICLE_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.con = None
+        self.lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        'The database is only opened (and created) on first use'
+        if self.con is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.con = sqlite3.connect(self.path, check_same_thread=False)
+            self.con.execute("CREATE TABLE IF NOT EXISTS articles (" +
+                "url TEXT PRIMARY KEY, text TEXT, images TEXT, etag TEXT, modified TEXT, " +
+                "expires REAL, size INTEGER, used REAL)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS articles_used ON articles (used)")
+            self.con.commit()
+        return self.con
+
+    def get(self, url : str) -> dict:
+        'The cached entry of url (text, images, fresh and validators) or None'
+        with self.lock:
+            con = self.connection()
+            row = con.execute("SELECT text, images, etag, modified, expires FROM articles " +
+                "WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            con.execute("UPDATE articles SET used = ? WHERE url = ?", (time.time(), url))
+            con.commit()
+        text, images, etag, modified, expires = row
+        return {
+            'text' : text,
+            'images' : json.loads(images),
+            'fresh' : time.time() < expires,
+            'etag' : etag,
+            'modified' : modified,
+        }
+
+    @staticmethod
+    def conditional_headers(entry : dict) -> dict:
+        'The validators to revalidate an expired entry'
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['modified']:
+            headers['If-Modified-Since'] = entry['modified']
+        return headers
+
+    def put(self, url : str, text : str, images : list, headers):
+        'Store what was extracted from a response, evicting the oldest entries if needed'
+        lifetime = cacheLifetime(headers, self.ttl)
+        if lifetime is None:
+            return
+        images = json.dumps(images)
+        size = len(url) + len(text.encode('utf-8')) + len(images)
+        now = time.time()
+        with self.lock:
+            con = self.connection()
+            con.execute("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, text, images, headers.get('ETag'), headers.get('Last-Modified'),
+                now + lifetime, size, now))
+            total = con.execute("SELECT SUM(size) FROM articles").fetchone()[0]
+            if total > self.max_bytes:
+                evicted = []
+                for old_url, old_size in con.execute(
+                        "SELECT url, size FROM articles ORDER BY used"):
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((old_url,))
+                    total -= old_size
+                con.executemany("DELETE FROM articles WHERE url = ?", evicted)
+            con.commit()
+
+    def refresh(self, url : str, headers):
+        'The page was not modified (304): it is fresh again'
+        lifetime = cacheLifetime(headers, self.ttl)
+        with self.lock:
+            con = self.connection()
+            if lifetime is None:
+                con.execute("DELETE FROM articles WHERE url = ?", (url,))
+            else:
+                con.execute("UPDATE articles SET expires = ? WHERE url = ?",
+                    (time.time() + lifetime, url))
+            con.commit()
+
+    def close(self):
+        'To close the database'
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+                self.con = None
+
+def normalize_link(link : str) -> str:
+    '''
+    To compare links: lower case scheme and host, no fragment, no
+    trailing slash and no tracking (utm_*) parameters.
+    '''
+    parsed = urlparse(link.strip())
+    query = urlencode([
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not key.startswith('utm_')
+    ])
+    path = parsed.path.rstrip('/')
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), path,
+        parsed.params, query, ''))
+
+def content_hash(text : str) -> str:
+    'Hash of the article text, ignoring case and white spaces'
+    normalized = ' '.join(text.lower().split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+class SeenStore:
+    '''
+    Persistent (sqlite) record of the articles already handled, by
+    normalized link and content hash, so they don't go through the
+    fetch/summary/translation pipeline again.
+    '''
+    NOT_INTERESTING = 'not_interesting'
+    REJECTED = 'rejected'
+    # in the publish outbox
+    QUEUED = 'queued'
+    PUBLISHED = 'published'
+
+    def __init__(self, path : str):
+        self.path = path
+        self.con = None
+
+    def connection(self) -> sqlite3.Connection:
+        'The database is only opened (and created) on first use'
+        if self.con is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.con = sqlite3.connect(self.path)
+            self.con.execute("CREATE TABLE IF NOT EXISTS seen_articles (" +
+                "link TEXT PRIMARY KEY, content_hash TEXT, status TEXT, updated REAL)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS seen_articles_hash " +
+                "ON seen_articles (content_hash)")
+            self.con.commit()
+        return self.con
+
+    def is_seen(self, link : str) -> bool:
+        'Was this link already handled?'
+        row = self.connection().execute("SELECT 1 FROM seen_articles WHERE link = ?",
+            (normalize_link(link),)).fetchone()
+        return row is not None
+
+    def is_content_seen(self, digest : str) -> bool:
+        'Was the same content already handled under some other link?'
+        row = self.connection().execute(
+            "SELECT 1 FROM seen_articles WHERE content_hash = ? AND status != ?",
+            (digest, self.NOT_INTERESTING)).fetchone()
+        return row is not None
+
+    def mark(self, link : str, status : str, digest : str = None):
+        'Record the outcome for a link'
+        con = self.connection()
+        con.execute("INSERT OR REPLACE INTO seen_articles VALUES (?, ?, ?, ?)",
+            (normalize_link(link), digest, status, time.time()))
+        con.commit()
+
+    def close(self):
+        'To close the database'
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+def text_shingles(text : str, size : int = SHINGLE_SIZE) -> set:
+    'The 64 bits hashes of the sequences of size words of text'
+    words = re.findall(r"\w+", text.lower())
+    return {
+        int.from_bytes(hashlib.blake2b(
+            " ".join(words[index:index + size]).encode('utf-8'), digest_size=8).digest(), 'big')
+        for index in range(max(1, len(words) - size + 1))
+    } if words else set()
+
+class NearDuplicateIndex:
+    '''
+    Persistent (sqlite) MinHash signatures of the articles already
+    accepted, to find the same story under another link or with small
+    changes.  The signatures are split in bands and only the articles
+    sharing a whole band (LSH) are compared, so a lookup doesn't grow
+    with the size of the index.
+    The signature is computed with one permutation hashing: a single pass
+    over the shingles, each going to one of size bins by its hash, instead
+    of size passes.
+    '''
+    # stored in the database (user_version): the signatures of another
+    # version (or size) can't be compared and are dropped
+    SIGNATURE_VERSION = 2
+
+    def __init__(self, path : str, threshold : float = NEAR_DUPLICATE_THRESHOLD,
+            size : int = MINHASH_SIZE, bands : int = MINHASH_BANDS):
+        self.path = path
+        self.con = None
+        self.threshold = threshold
+        self.size = size
+        self.bands = bands
+        self.rows = size // bands
+        # normalized link -> signature of the articles accepted in this run,
+        # only stored once they are published (see add())
+        self.pending = {}
+
+    def connection(self) -> sqlite3.Connection:
+        'The database is only opened (and created) on first use'
+        if self.con is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.con = sqlite3.connect(self.path)
+            self.con.execute("CREATE TABLE IF NOT EXISTS signatures (" +
+                "id INTEGER PRIMARY KEY, link TEXT, signature BLOB, created REAL)")
+            self.con.execute("CREATE TABLE IF NOT EXISTS bands (" +
+                "band INTEGER, bucket INTEGER, signature_id INTEGER)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket)")
+            version = self.SIGNATURE_VERSION * 1000 + self.size
+            if self.con.execute("PRAGMA user_version").fetchone()[0] != version:
+                self.con.execute("DELETE FROM signatures")
+                self.con.execute("DELETE FROM bands")
+                self.con.execute(f"PRAGMA user_version = {version}")
+            self.con.commit()
+        return self.con
+
+    def signature(self, text : str) -> list:
+        'MinHash of the text shingles, None for a text without words'
+        shingles = text_shingles(text)
+        if not shingles:
+            return None
+        size = self.size
+        empty = 1 << 64
+        bins = [ empty ] * size
+        for shingle in shingles:
+            index = shingle % size
+            value = shingle // size
+            if value < bins[index]:
+                bins[index] = value
+        # short texts leave bins empty: they take the value of the next
+        # filled bin, mixed with the distance to it (kept in 64 bits)
+        step = empty // size
+        for index in range(size):
+            if bins[index] == empty:
+                for distance in range(1, size):
+                    value = bins[(index + distance) % size]
+                    if value != empty:
+                        bins[index] = (value + distance * step) % empty
+                        break
+        return bins
+
+    def buckets(self, signature : list) -> list:
+        'The (band, bucket) pairs of a signature'
+        return [
+            (band, int.from_bytes(hashlib.blake2b(
+                array('Q', signature[band * self.rows:(band + 1) * self.rows]).tobytes(),
+                digest_size=8).digest(), 'big', signed=True))
+            for band in range(self.bands)
+        ]
+
+    @staticmethod
+    def similarity(signature : list, other) -> float:
+        'Estimated similarity of two texts, from their signatures'
+        return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+    def find(self, link : str, signature : list) -> str:
+        '''
+        The link of an indexed (or accepted in this run) article with an
+        estimated similarity of at least threshold, other than link itself,
+        or None.
+        '''
+        if signature is None:
+            return None
+        con = self.connection()
+        candidates = set()
+        for band, bucket in self.buckets(signature):
+            candidates.update(row[0] for row in con.execute(
+                "SELECT signature_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket)))
+        link = normalize_link(link)
+        for candidate in candidates:
+            other_link, blob = con.execute(
+                "SELECT link, signature FROM signatures WHERE id = ?", (candidate,)).fetchone()
+            if other_link == link:
+                continue
+            other = array('Q')
+            other.frombytes(blob)
+            if self.similarity(signature, other) >= self.threshold:
+                return other_link
+        for other_link, other in self.pending.items():
+            if other_link != link and self.similarity(signature, other) >= self.threshold:
+                return other_link
         return None
-    response = requests.get(link, timeout=10)
 
-    save_extension = extension.split("/")[1]
-    logger.debug('getimage() suffix: %s', save_extension)
+    def hold(self, link : str, signature : list):
+        'An article accepted in this run, compared with the next ones but not stored yet'
+        if signature is not None:
+            self.pending[normalize_link(link)] = signature
 
-    image_file = tempfile.mkstemp(suffix='.' + save_extension)
-    with open(image_file[1], "wb") as f:
-        f.write(response.content)
-    return image_file[1]
+    def add(self, link : str):
+        '''
+        Index an article held in this run, once it is published.  The
+        previous signature of the same link is replaced.
+        '''
+        link = normalize_link(link)
+        signature = self.pending.pop(link, None)
+        if signature is None:
+            return
+        con = self.connection()
+        con.execute("DELETE FROM bands WHERE signature_id IN " +
+            "(SELECT id FROM signatures WHERE link = ?)", (link,))
+        con.execute("DELETE FROM signatures WHERE link = ?", (link,))
+        cur = con.execute("INSERT INTO signatures (link, signature, created) VALUES (?, ?, ?)",
+            (link, array('Q', signature).tobytes(), time.time()))
+        con.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+            [ (band, bucket, cur.lastrowid) for band, bucket in self.buckets(signature) ])
+        con.commit()
+
+    def close(self):
+        'To close the database'
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+class MediaIndex:
+    '''
+    Persistent (sqlite) index of the images already uploaded to WordPress,
+    by source url and content hash, so the same image is only uploaded
+    once.  Only the first MEDIA_HASH_SIZE characters of the hash are kept,
+    the same ones found in the uploaded file names.
+    It is used from the publishing threads.
+    '''
+    def __init__(self, path : str):
+        self.path = path
+        self.con = None
+        self.lock = threading.Lock()
+        # key -> (lock, threads using it), see uploading()
+        self.uploads = {}
+
+    def connection(self) -> sqlite3.Connection:
+        'The database is only opened (and created) on first use'
+        if self.con is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.con = sqlite3.connect(self.path, check_same_thread=False)
+            self.con.execute("CREATE TABLE IF NOT EXISTS media (" +
+                "source_url TEXT, content_hash TEXT, media_id INTEGER)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS media_url ON media (source_url)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS media_hash ON media (content_hash)")
+            self.con.execute("CREATE TABLE IF NOT EXISTS sync (" +
+                "key TEXT PRIMARY KEY, value TEXT)")
+            self.con.commit()
+        return self.con
+
+    def is_rebuilt(self) -> bool:
+        'Was the index filled from the images already in WordPress?'
+        with self.lock:
+            row = self.connection().execute(
+                "SELECT 1 FROM sync WHERE key = 'rebuilt'").fetchone()
+        return row is not None
+
+    def rebuilt(self):
+        'Record that all the images of WordPress were added'
+        with self.lock:
+            con = self.connection()
+            con.execute("INSERT OR REPLACE INTO sync VALUES ('rebuilt', ?)", (str(time.time()),))
+            con.commit()
+
+    def lookup(self, column : str, value : str) -> int:
+        'The media id for the source_url or content_hash, None if unknown'
+        with self.lock:
+            row = self.connection().execute(
+                f"SELECT media_id FROM media WHERE {column} = ?", (value,)).fetchone()
+        return None if row is None else row[0]
+
+    def by_url(self, source_url : str) -> int:
+        'The media id of an image url'
+        return self.lookup('source_url', source_url)
+
+    def by_hash(self, digest : str) -> int:
+        'The media id of an image content'
+        return self.lookup('content_hash', digest[:MEDIA_HASH_SIZE])
+
+    def add(self, source_url : str, digest : str, media_id : int):
+        'Record an uploaded image (source_url is None when rebuilt from WordPress)'
+        with self.lock:
+            con = self.connection()
+            con.execute("INSERT INTO media VALUES (?, ?, ?)",
+                (source_url, digest[:MEDIA_HASH_SIZE], media_id))
+            con.commit()
+
+    @contextmanager
+    def uploading(self, key : str):
+        '''
+        Held while the image with this key (url or content hash) is looked
+        up and uploaded, so the other articles with the same image wait for
+        that upload and reuse it instead of uploading it again.
+        '''
+        with self.lock:
+            lock, users = self.uploads.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self.uploads[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self.lock:
+                users = self.uploads[key][1] - 1
+                if users:
+                    self.uploads[key] = (lock, users)
+                else:
+                    del self.uploads[key]
+
+    def forget(self, media_id : int):
+        'Remove a media that is no longer valid'
+        with self.lock:
+            con = self.connection()
+            con.execute("DELETE FROM media WHERE media_id = ?", (media_id,))
+            con.commit()
+
+    def close(self):
+        'To close the database'
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+                self.con = None
+
+class PostIndex:
+    '''
+    Persistent (sqlite) index of all the posts published in WordPress, by
+    normalized title and by source link (the "Fonte:" of their content),
+    to know whether an article was already published.  It is kept up to
+    date with the posts modified since the last sync.
+    '''
+    SOURCE_RE = re.compile(r'Fonte:\s*<a href="([^"]+)"')
+    # typography WordPress applies to titles (wptexturize)
+    TEXTURIZED = str.maketrans({ '‘' : "'", '’' : "'", '“' : '"', '”' : '"',
+        '–' : '-', '—' : '-', '…' : '...' })
+
+    def __init__(self, path : str):
+        self.path = path
+        self.con = None
+
+    def connection(self) -> sqlite3.Connection:
+        'The database is only opened (and created) on first use'
+        if self.con is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.con = sqlite3.connect(self.path)
+            self.con.execute("CREATE TABLE IF NOT EXISTS posts (" +
+                "id INTEGER PRIMARY KEY, slug TEXT, title TEXT, source TEXT, date TEXT)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS posts_title ON posts (title)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS posts_source ON posts (source)")
+            self.con.execute("CREATE TABLE IF NOT EXISTS sync (" +
+                "key TEXT PRIMARY KEY, value TEXT)")
+            self.con.commit()
+        return self.con
+
+    @classmethod
+    def normalize_title(cls, title : str) -> str:
+        'To compare titles: no html entities, typography, case or extra spaces'
+        return ' '.join(unescape(title).translate(cls.TEXTURIZED).lower().split())
+
+    @classmethod
+    def source(cls, post : dict) -> str:
+        'The normalized "Fonte:" link of a post, None if it has none'
+        match = cls.SOURCE_RE.search(post.get('content', {}).get('rendered', ''))
+        return normalize_link(unescape(match.group(1))) if match else None
+
+    def last_modified(self) -> str:
+        'The modification date of the most recent post indexed, None if empty'
+        row = self.connection().execute(
+            "SELECT value FROM sync WHERE key = 'modified'").fetchone()
+        return row[0] if row else None
+
+    def add(self, posts : list):
+        'Index posts as returned by /wp-json/wp/v2/posts'
+        con = self.connection()
+        modified = self.last_modified()
+        for post in posts:
+            con.execute("INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?)",
+                (post['id'], post.get('slug'),
+                self.normalize_title(post.get('title', {}).get('rendered', '')),
+                self.source(post), post.get('date')))
+            if post.get('modified') and (modified is None or post['modified'] > modified):
+                modified = post['modified']
+        if modified is not None:
+            con.execute("INSERT OR REPLACE INTO sync VALUES ('modified', ?)", (modified,))
+        con.commit()
+
+    def has_title(self, title : str) -> bool:
+        'Is there a post with this title?'
+        row = self.connection().execute("SELECT 1 FROM posts WHERE title = ?",
+            (self.normalize_title(title),)).fetchone()
+        return row is not None
+
+    def has_source(self, link : str) -> bool:
+        'Is there a post about this link?'
+        row = self.connection().execute("SELECT 1 FROM posts WHERE source = ?",
+            (normalize_link(link),)).fetchone()
+        return row is not None
+
+    def close(self):
+        'To close the database'
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+class PublishOutbox:
+    '''
+    Persistent (sqlite) posts ready to be sent to WordPress (slug, title,
+    content, media id) whose publishing failed.  They are sent again in
+    the next runs, with exponential backoff, without going through the
+    rest of the pipeline.  The slug is the key, so a post is never queued
+    twice; another pending post with the same slug gets a "-2" suffix, as
+    WordPress would do.
+    It is used from the publishing threads.
+    '''
+    PENDING = 'pending'
+    POSTED = 'posted'
+    ABANDONED = 'abandoned'
+
+    def __init__(self, path : str, backoff : float = PUBLISH_RETRY_BACKOFF,
+            max_backoff : float = PUBLISH_RETRY_MAX_BACKOFF,
+            max_attempts : int = PUBLISH_RETRY_MAX_ATTEMPTS):
+        self.path = path
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.con = None
+        self.lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        'The database is only opened (and created) on first use'
+        if self.con is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.con = sqlite3.connect(self.path, check_same_thread=False)
+            self.con.row_factory = sqlite3.Row
+            self.con.execute("CREATE TABLE IF NOT EXISTS outbox (" +
+                "slug TEXT PRIMARY KEY, title TEXT, content TEXT, image TEXT, " +
+                "media_id INTEGER, link TEXT, hash TEXT, status TEXT, attempts INTEGER, " +
+                "next_attempt REAL, post_id INTEGER, created REAL)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS outbox_due " +
+                "ON outbox (status, next_attempt)")
+            self.con.commit()
+        return self.con
+
+    def add(self, post : dict):
+        '''
+        Queue a post whose first attempt failed.  An old post (posted or
+        abandoned) with the same slug is replaced.
+        '''
+        with self.lock:
+            con = self.connection()
+            slug = post['slug']
+            suffix = 2
+            while True:
+                row = con.execute("SELECT link, status FROM outbox WHERE slug = ?",
+                    (slug,)).fetchone()
+                if row is None or row['status'] != self.PENDING or row['link'] == post['link']:
+                    break
+                slug = f"{post['slug']}-{suffix}"
+                suffix += 1
+            post['slug'] = slug
+            con.execute("INSERT OR REPLACE INTO outbox VALUES " +
+                "(?, ?, ?, ?, ?, ?, ?, ?, 1, ?, NULL, ?)",
+                (post['slug'], post['title'], post['content'], post['image'],
+                post['media_id'], post['link'], post['hash'], self.PENDING,
+                time.time() + self.backoff, time.time()))
+            con.commit()
+
+    def due(self, now : float = None) -> list:
+        'The pending posts whose next attempt is due'
+        if now is None:
+            now = time.time()
+        with self.lock:
+            rows = self.connection().execute(
+                "SELECT * FROM outbox WHERE status = ? AND next_attempt <= ? " +
+                "ORDER BY created", (self.PENDING, now)).fetchall()
+        return [ dict(row) for row in rows ]
+
+    def posted(self, slug : str, post_id : int):
+        'The post was published'
+        with self.lock:
+            con = self.connection()
+            con.execute("UPDATE outbox SET status = ?, post_id = ? WHERE slug = ?",
+                (self.POSTED, post_id, slug))
+            con.commit()
+
+    def failed(self, post : dict) -> bool:
+        '''
+        Another failed attempt: the next one is delayed twice as much, or
+        it is abandoned after max_attempts.  It returns whether it will be
+        tried again.
+        '''
+        attempts = post['attempts'] + 1
+        retry = attempts < self.max_attempts
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        with self.lock:
+            con = self.connection()
+            con.execute("UPDATE outbox SET status = ?, attempts = ?, next_attempt = ?, " +
+                "media_id = ? WHERE slug = ?",
+                (self.PENDING if retry else self.ABANDONED, attempts, time.time() + delay,
+                post['media_id'], post['slug']))
+            con.commit()
+        return retry
+
+    def close(self):
+        'To close the database'
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+                self.con = None
+
+class GoogleTranslateBackend:
+    '''
+    Translation backend using googletrans.  Several texts are joined in
+    the same request (up to max_chars), falling back to one request per
+    text when the translated batch can't be split back.
+    Any other backend only needs the same translate() method.
+    '''
+    SEPARATOR = "\n\n"
+
+    def __init__(self, max_chars : int = TRANSLATION_BATCH_CHARS):
+        self.max_chars = max_chars
+        self.translator = None
+
+    def get_translator(self):
+        'The googletrans client, only created when the first text is translated'
+        if self.translator is None:
+            from googletrans import Translator # pylint: disable=C0415
+            self.translator = Translator(service_urls=['translate.google.com'])
+        return self.translator
+
+    def translate_one(self, text : str, src : str, dest : str) -> str:
+        'One text per request, None if it failed'
+        try:
+            return self.get_translator().translate(text, src=src, dest=dest).text
+        except TypeError:
+            logger.error("Translation failed for: %s", text)
+            return None
+
+    def chunks(self, texts : list) -> list:
+        'Group the texts in batches up to max_chars'
+        chunks = [ [] ]
+        size = 0
+        for text in texts:
+            if chunks[-1] and size + len(text) > self.max_chars:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(text)
+            size += len(text) + len(self.SEPARATOR)
+        return chunks
+
+    def translate(self, texts : list, src : str, dest : str) -> list:
+        'Translate a list of texts, None for the ones that failed'
+        results = []
+        for chunk in self.chunks(texts):
+            translated = None
+            if len(chunk) > 1 and not any(self.SEPARATOR in text for text in chunk):
+                joined = self.translate_one(self.SEPARATOR.join(chunk), src, dest)
+                if joined is not None:
+                    translated = joined.split(self.SEPARATOR)
+                if translated is None or len(translated) != len(chunk):
+                    logger.debug('batch translation not split back, one by one')
+                    translated = None
+            if translated is None:
+                translated = [ self.translate_one(text, src, dest) for text in chunk ]
+            results.extend(translated)
+        return results
+
+class TranslationCache:
+    '''
+    Persistent (sqlite) translations keyed by the hash of the source text
+    and language pair.  The least recently used entries are evicted when
+    it grows over max_entries.
+    '''
+    def __init__(self, path : str, max_entries : int = TRANSLATION_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.con = None
+
+    def connection(self) -> sqlite3.Connection:
+        'The database is only opened (and created) on first use'
+        if self.con is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.con = sqlite3.connect(self.path)
+            self.con.execute("CREATE TABLE IF NOT EXISTS translations (" +
+                "key TEXT PRIMARY KEY, translation TEXT, used REAL)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS translations_used " +
+                "ON translations (used)")
+            self.con.commit()
+        return self.con
+
+    @staticmethod
+    def key(text : str, src : str, dest : str) -> str:
+        'Content address of a translation'
+        return hashlib.sha256(f"{src}:{dest}:{text}".encode('utf-8')).hexdigest()
+
+    def get(self, text : str, src : str, dest : str) -> str:
+        'The cached translation or None'
+        con = self.connection()
+        key = self.key(text, src, dest)
+        row = con.execute("SELECT translation FROM translations WHERE key = ?",
+            (key,)).fetchone()
+        if row is None:
+            return None
+        con.execute("UPDATE translations SET used = ? WHERE key = ?", (time.time(), key))
+        con.commit()
+        return row[0]
+
+    def put(self, text : str, src : str, dest : str, translation : str):
+        'Store a translation, evicting the oldest ones if needed'
+        con = self.connection()
+        con.execute("INSERT OR REPLACE INTO translations VALUES (?, ?, ?)",
+            (self.key(text, src, dest), translation, time.time()))
+        count = con.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        if count > self.max_entries:
+            con.execute("DELETE FROM translations WHERE key IN " +
+                "(SELECT key FROM translations ORDER BY used LIMIT ?)",
+                (count - self.max_entries,))
+        con.commit()
+
+    def close(self):
+        'To close the database'
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+class TranslationService:
+    '''
+    Translations through a pluggable backend, with an optional cache.
+    Only the texts not found in the cache are sent to the backend, all of
+    them in a single batch.
+    '''
+    def __init__(self, backend, cache : TranslationCache = None):
+        self.backend = backend
+        self.cache = cache
+        # cumulative cache hits and texts sent to the backend
+        self.hits = 0
+        self.misses = 0
+
+    def translate(self, texts : list, src : str = 'en', dest : str = 'pt') -> list:
+        '''
+        Translate a list of texts.  A failed translation (or one returning
+        the same text) is None.
+        '''
+        results = [ None ] * len(texts)
+        missing = {}
+        for index, text in enumerate(texts):
+            cached = None
+            if self.cache is not None:
+                cached = self.cache.get(text, src, dest)
+            if cached is not None:
+                results[index] = cached
+                self.hits += 1
+            else:
+                missing.setdefault(text, []).append(index)
+        if not missing:
+            return results
+        self.misses += len(missing)
+
+        sources = list(missing)
+        for source, translated in zip(sources, self.backend.translate(sources, src, dest)):
+            if translated is None or translated == source:
+                logger.error("Translation failed: %s", source)
+                continue
+            if self.cache is not None:
+                self.cache.put(source, src, dest, translated)
+            for index in missing[source]:
+                results[index] = translated
+        return results
+
+class Summarizer:
+    '''
+    Extractive summary: the sentences with the highest sum of their (non
+    stop) word frequencies over the whole text.  NLTK resources are loaded
+    only once and each sentence is tokenized only once.
+    '''
+    def __init__(self, language : str = "english", size : int = 5,
+            max_sentence_words : int = 30):
+        self.language = language
+        self.size = size
+        # longer sentences are not used in the summary
+        self.max_sentence_words = max_sentence_words
+        self.stop_words = None
+        self.sent_tokenize = None
+        self.word_tokenizer = None
+
+    def load(self, download : bool = True):
+        '''
+        To load the tokenizers and stop words.  Missing NLTK data is
+        downloaded, unless download is False (then LookupError is raised).
+        '''
+        if self.stop_words is not None:
+            return
+        import nltk # pylint: disable=C0415
+        from nltk.tokenize import sent_tokenize, NLTKWordTokenizer # pylint: disable=C0415
+        from nltk.corpus import stopwords # pylint: disable=C0415
+        try:
+            sent_tokenize("Loading.", self.language)
+            stop_words = stopwords.words(self.language)
+        except LookupError:
+            if not download:
+                raise
+            logger.info("initializing nltk")
+            for resource in NLTK_RESOURCES:
+                nltk.download(resource)
+
+            # trying again
+            sent_tokenize("Loading.", self.language)
+            stop_words = stopwords.words(self.language)
+        self.sent_tokenize = sent_tokenize
+        # same tokenizer used by nltk.word_tokenize()
+        self.word_tokenizer = NLTKWordTokenizer()
+        self.stop_words = frozenset(stop_words)
+
+    def summarize(self, text : str) -> str:
+        'Generate the summary of text'
+        self.load()
+        sentences = self.sent_tokenize(text, self.language)
+        tokenized = [
+            [ word.lower() for word in self.word_tokenizer.tokenize(sentence) ]
+            for sentence in sentences
+        ]
+        word_frequencies = Counter(
+            word for words in tokenized for word in words if word not in self.stop_words
+        )
+
+        sentence_scores = {}
+        for sentence, words in zip(sentences, tokenized):
+            if len(sentence.split(" ")) >= self.max_sentence_words:
+                continue
+            score = sum(
+                count * word_frequencies[word]
+                for word, count in Counter(words).items() if word in word_frequencies
+            )
+            if score == 0:
+                # no word of interest
+                continue
+            # repeated sentences add up, as a single entry
+            sentence_scores[sentence] = sentence_scores.get(sentence, 0) + score
+
+        summary_sentences = nlargest(
+            self.size, sentence_scores, key=sentence_scores.get)
+        return " ".join(summary_sentences)
+
+SUMMARIZER = Summarizer()
+
+def newProcessPool(workers : int, initializer=None, # pylint: disable=C0103
+        initargs : tuple = ()) -> ProcessPoolExecutor:
+    '''
+    A pool of worker processes started from a fresh server process
+    (forkserver), never forked from the bot: its workers are started on
+    demand from the fetch and publish threads, and forking while other
+    threads hold locks (http, sqlite, logging) can deadlock the child.
+    '''
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+        initargs=initargs, mp_context=multiprocessing.get_context(method))
+
+def initCpuWorker(http : dict = None): # pylint: disable=C0103
+    '''
+    Start of a CPU pool worker: the NLTK data is loaded only once and the
+    http session gets the settings of the bot.
+    '''
+    SUMMARIZER.load()
+    if http is not None:
+        configure_http_session(**http)
+
+def extractArticle(url : str, max_bytes : int, stats : RunStats = None, # pylint: disable=C0103
+        headers : dict = None, response_info : dict = None) -> tuple:
+    '''
+    Download and parse an article page, stopping as soon as the article
+    and an image were found.  It returns (text, image urls, seconds spent
+    parsing); the status and headers of the response are set in
+    response_info and nothing is parsed when the page was not modified.
+    '''
+    extractor = ArticleExtractor(url)
+    parsing = 0.0
+    for html_content in streamHtmlContent(url, max_bytes, stats, headers, response_info):
+        parse_start = time.perf_counter()
+        extractor.feed(html_content)
+        parsing += time.perf_counter() - parse_start
+        if extractor.done:
+            break
+    extractor.close()
+    images = [ extractor.image ] if extractor.image is not None else []
+    return (extractor.text(), images, parsing)
+
+def fetchAndSummarize(url : str, max_bytes : int, headers : dict = None) -> dict: # pylint: disable=C0103
+    '''
+    Download, parse and summarize an article in a CPU pool worker, with
+    the same early stop as the fetch threads.  Only the results go back to
+    the bot: text, image urls, summary, status and headers of the response,
+    html bytes read and seconds per phase (or the error of the download).
+    '''
+    stats = RunStats()
+    response_info = {}
+    started = time.perf_counter()
+    try:
+        text, images, parsing = extractArticle(url, max_bytes, stats, headers, response_info)
+    except (ConnectionError, requests.exceptions.RequestException) as e:
+        return {'error': str(e), 'fetch': time.perf_counter() - started, 'parse': 0.0,
+            'html_bytes': stats.counters['html_bytes']}
+    fetched = time.perf_counter()
+    summary = None
+    if response_info['status'] != 304:
+        summary = SUMMARIZER.summarize(text)
+    return {
+        'text': text,
+        'images': images,
+        'summary': summary,
+        'status': response_info['status'],
+        'headers': requests.structures.CaseInsensitiveDict(response_info['headers']),
+        'html_bytes': stats.counters['html_bytes'],
+        'fetch': fetched - started - parsing,
+        'parse': parsing,
+        'summarize': time.perf_counter() - fetched
+    }
+
+def summarizeText(text : str) -> tuple: # pylint: disable=C0103
+    'Summary of an already extracted text in a CPU pool worker, with the seconds spent'
+    started = time.perf_counter()
+    summary = SUMMARIZER.summarize(text)
+    return (summary, time.perf_counter() - started)
+
+def prepare():
+    '''
+    Warm up meant for image build time: download the NLTK data and check
+    the heavy dependencies, so no run has to do it.
+    '''
+    SUMMARIZER.load()
+    import feedparser # pylint: disable=C0415,W0611
+    import googletrans # pylint: disable=C0415,W0611
+    logger.info('NLTK data and dependencies ready')
+
+class HostLimiter:
+    'To limit how many simultaneous requests go to the same host'
+    def __init__(self, per_host : int):
+        self.per_host = per_host
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def limit(self, link : str):
+        'Hold one of the host slots while the block runs'
+        host = urlparse(link).netloc
+        with self.lock:
+            semaphore = self.semaphores.setdefault(
+                host, threading.BoundedSemaphore(self.per_host))
+        with semaphore:
+            yield
+
+def detectImageType(data : bytes) -> str: # pylint: disable=C0103
+    'Content type of an image from its first bytes, None if it is not an image'
+    import magic # pylint: disable=C0415
+    image_type = magic.from_buffer(data, mime=True)
+    if not image_type.startswith('image/'):
+        return None
+    return image_type
+
+def imageFilename(link : str, image_type : str, digest : str = None) -> str: # pylint: disable=C0103
+    '''
+    A file name for the image, with the extension of its real type and
+    the content hash (so the media index can be rebuilt from WordPress).
+    '''
+    name = os.path.splitext(os.path.basename(urlparse(link).path))[0] or 'image'
+    if digest is not None:
+        name += '-' + digest[:MEDIA_HASH_SIZE]
+    extension = mimetypes.guess_extension(image_type) or ''
+    return name + extension
+
+class DownloadedImage:
+    '''
+    A downloaded image with its type.  It is kept in memory: the content
+    hash of the media index needs all of it before the upload anyway.
+    '''
+    def __init__(self, link : str, image_type : str, data : bytes):
+        self.link = link
+        self.image_type = image_type
+        self.data = data
+
+    @property
+    def size(self) -> int:
+        'Size in bytes'
+        return len(self.data)
+
+def transcodeImage(data : bytes, image_type : str, max_dimension : int, # pylint: disable=C0103,R0913
+        min_dimension : int, image_format : str, quality : int):
+    '''
+    Downscale the image to max_dimension and re-encode it as image_format.
+    It returns (data, image type), or None when the image is smaller than
+    min_dimension (tracking pixels, icons).  Images Pillow can't read
+    (svg, truncated, too big to decode) or animated ones are kept as they
+    are.
+    It runs in the image processing pool.
+    '''
+    from PIL import Image # pylint: disable=C0415
+    try:
+        image = Image.open(io.BytesIO(data))
+        if min(image.size) < min_dimension:
+            return None
+        if getattr(image, 'is_animated', False):
+            return (data, image_type)
+
+        resized = max(image.size) > max_dimension
+        if resized:
+            image.thumbnail((max_dimension, max_dimension))
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality)
+        encoded = output.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        # UnidentifiedImageError is an OSError
+        logger.debug('Image kept as it is (%s)', e)
+        return (data, image_type)
+    if not resized and len(encoded) >= len(data):
+        # nothing gained
+        return (data, image_type)
+    return (encoded, Image.MIME[image_format])
+
+@contextmanager
+def openImage(link : str, max_bytes : int = IMAGE_MAX_BYTES): # pylint: disable=C0103
+    '''
+    To download an image.  It gives a DownloadedImage, or None if it
+    isn't an image or is bigger than max_bytes.
+    '''
+    with get_http_session().get(link, timeout=10, stream=True) as response:
+        yield readImage(link, response, max_bytes)
+
+def readImage(link : str, response, max_bytes : int): # pylint: disable=C0103
+    'Check the image type from its first bytes and read the rest of it'
+    if response.status_code != 200:
+        logger.error('Failed to fetch image %s: %d', link, response.status_code)
+        return None
+    size = response.headers.get('content-length')
+    size = int(size) if size and size.isdigit() else None
+    if size is not None and size > max_bytes:
+        logger.info('Image too big (%d bytes): %s', size, link)
+        return None
+
+    chunks = response.iter_content(chunk_size=64 * 1024)
+    head = bytearray()
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 4096:
+            break
+    image_type = detectImageType(bytes(head))
+    if image_type is None:
+        logger.info('Not an image: %s', link)
+        return None
+
+    # Content-Length may be missing or wrong (compressed), the limit is
+    # checked on what is received
+    for chunk in chunks:
+        head += chunk
+        if len(head) > max_bytes:
+            logger.info('Image too big (over %d bytes): %s', max_bytes, link)
+            return None
+    return DownloadedImage(link, image_type, bytes(head))
 
 def prettyprint(data):
     'Just nice json formmating and printing'
@@ -98,6 +1650,26 @@ def applyTextCorrections(text): # pylint: disable=C0103
             text = re.sub(term, replacement, text)
     return text
 
+class Article: # pylint: disable=R0903
+    '''
+    An article on its way from the feeds to WordPress.  Only the fields the
+    pipeline needs are kept, in slots (no dict per article), and the text
+    of the page is never stored: it is dropped once summarized.  title is
+    replaced by its translation before publishing.
+    '''
+    __slots__ = ('title', 'link', 'hash', 'summary', 'image', 'content')
+
+    def __init__(self, title : str, link : str):
+        self.title = title
+        self.link = link
+        self.hash = None
+        self.summary = None
+        self.image = None
+        self.content = None
+
+    def __repr__(self):
+        return f"Article({self.title!r}, {self.link!r})"
+
 class NewsBot:
     'Class to control bot behavior'
     def __init__(self, config=None):
@@ -107,6 +1679,7 @@ class NewsBot:
         self.configFile = config # pylint: disable=C0103
 
         self.articles = []
+        self.stats = RunStats()
         self.readConfiguration()
 
     def readConfiguration(self): # pylint: disable=C0103
@@ -117,30 +1690,94 @@ class NewsBot:
             'site' : cfg.get('WORDPRESS', 'SITE'),
             'token' : cfg.get('WORDPRESS', 'TOKEN')
         }
+        self.fetch = {
+            'workers' : cfg.getint('FETCH', 'WORKERS', fallback=FETCH_WORKERS),
+            'feed_workers' : cfg.getint('FETCH', 'FEED_WORKERS', fallback=FEED_WORKERS),
+            'per_host' : cfg.getint('FETCH', 'PER_HOST', fallback=FETCH_PER_HOST),
+            'max_html_bytes' : cfg.getint('FETCH', 'MAX_HTML_BYTES',
+                fallback=FETCH_MAX_HTML_BYTES)
+        }
+        self.images = {
+            'max_bytes' : cfg.getint('IMAGES', 'MAX_BYTES', fallback=IMAGE_MAX_BYTES),
+            'process' : cfg.getboolean('IMAGES', 'PROCESS', fallback=IMAGE_PROCESS),
+            'max_dimension' : cfg.getint('IMAGES', 'MAX_DIMENSION', fallback=IMAGE_MAX_DIMENSION),
+            'min_dimension' : cfg.getint('IMAGES', 'MIN_DIMENSION', fallback=IMAGE_MIN_DIMENSION),
+            'format' : cfg.get('IMAGES', 'FORMAT', fallback=IMAGE_FORMAT).upper(),
+            'quality' : cfg.getint('IMAGES', 'QUALITY', fallback=IMAGE_QUALITY),
+            'workers' : cfg.getint('IMAGES', 'WORKERS', fallback=IMAGE_WORKERS)
+        }
+        if self.images['process'] and importlib.util.find_spec('PIL') is None:
+            logger.warning('Pillow is not installed, images are uploaded as they are')
+            self.images['process'] = False
+        self.image_pool = None
+        self.image_pool_lock = threading.Lock()
+        self.cpu = {
+            'workers' : cfg.getint('CPU', 'WORKERS', fallback=CPU_WORKERS)
+        }
+        self.cpu_pool = None
+        self.cpu_pool_lock = threading.Lock()
+        self.telemetry = {
+            'json' : os.path.expanduser(cfg.get('TELEMETRY', 'REPORT_JSON', fallback='')),
+            'prometheus' : os.path.expanduser(cfg.get('TELEMETRY', 'PROMETHEUS_FILE', fallback=''))
+        }
+        self.daemon = {
+            'interval' : cfg.getfloat('DAEMON', 'INTERVAL', fallback=DAEMON_INTERVAL),
+            'jitter' : cfg.getfloat('DAEMON', 'JITTER', fallback=DAEMON_JITTER)
+        }
+        self.publish = {
+            'workers' : cfg.getint('PUBLISH', 'WORKERS', fallback=PUBLISH_WORKERS)
+        }
+        self.http = {
+            'pool_size' : cfg.getint('HTTP', 'POOL_SIZE', fallback=HTTP_POOL_SIZE),
+            'retries' : cfg.getint('HTTP', 'RETRIES', fallback=HTTP_RETRIES),
+            'backoff' : cfg.getfloat('HTTP', 'BACKOFF', fallback=HTTP_BACKOFF)
+        }
+        configure_http_session(**self.http)
+        self.cache_dir = os.path.expanduser(
+            cfg.get('CACHE', 'DIRECTORY', fallback=CACHE_DIR))
+        self.feeds = self.readFeeds(cfg)
+        self.feed_cache = FeedCache(os.path.join(self.cache_dir, 'feeds.json'))
+        self.article_cache = ArticleCache(os.path.join(self.cache_dir, 'articles.db'),
+            cfg.getfloat('CACHE', 'ARTICLE_TTL', fallback=ARTICLE_CACHE_TTL),
+            cfg.getint('CACHE', 'ARTICLE_MAX_BYTES', fallback=ARTICLE_CACHE_MAX_BYTES))
+        self.seen = SeenStore(os.path.join(self.cache_dir, 'seen.db'))
+        self.media_index = MediaIndex(os.path.join(self.cache_dir, 'media.db'))
+        self.post_index = PostIndex(os.path.join(self.cache_dir, 'posts.db'))
+        self.outbox = PublishOutbox(os.path.join(self.cache_dir, 'outbox.db'),
+            cfg.getfloat('PUBLISH', 'RETRY_BACKOFF', fallback=PUBLISH_RETRY_BACKOFF),
+            cfg.getfloat('PUBLISH', 'RETRY_MAX_BACKOFF', fallback=PUBLISH_RETRY_MAX_BACKOFF),
+            cfg.getint('PUBLISH', 'RETRY_MAX_ATTEMPTS', fallback=PUBLISH_RETRY_MAX_ATTEMPTS))
+        self.near_duplicates = NearDuplicateIndex(
+            os.path.join(self.cache_dir, 'near_duplicates.db'),
+            cfg.getfloat('DEDUP', 'THRESHOLD', fallback=NEAR_DUPLICATE_THRESHOLD))
+        self.translator = TranslationService(
+            GoogleTranslateBackend(
+                cfg.getint('TRANSLATION', 'BATCH_CHARS', fallback=TRANSLATION_BATCH_CHARS)),
+            TranslationCache(os.path.join(self.cache_dir, 'translations.db'),
+                cfg.getint('TRANSLATION', 'CACHE_SIZE', fallback=TRANSLATION_CACHE_SIZE))
+        )
 
-    def getSiteRSSTitles(self) -> list: # pylint: disable=C0103
-        'Fetch the RSS from the site hackernews'
-        fp = feedparser.parse(self.wordpress['site'] + '/feed/')
-        titles = list()
-        for e in fp['entries']:
-            titles.append(e['title'])
-        return titles
+    def readFeeds(self, cfg : configparser.ConfigParser) -> list: # pylint: disable=C0103
+        '''
+        The news sources, one [FEED <name>] section each, with its URL and
+        polling INTERVAL (seconds).  Without any, only HACKERNEWS_FEED.
+        '''
+        feeds = [ {
+            'name' : section.split(None, 1)[1],
+            'url' : cfg.get(section, 'URL'),
+            'interval' : cfg.getint(section, 'INTERVAL', fallback=FEED_INTERVAL)
+            } for section in cfg.sections() if section.startswith('FEED ') ]
+        if not feeds:
+            feeds.append({ 'name' : 'hackernews', 'url' : HACKERNEWS_FEED,
+                'interval' : FEED_INTERVAL })
+        return feeds
 
     def isTopicOfInterest(self, text : str) -> bool: # pylint: disable=C0103
         'Check whether a text is in the interesting word list or not'
-        score = 0
         words_of_interest = []
-        for word in INTERESTED_TERMS:
-            # [ \.,]open source[ \.,]|$
-            if re.search("[ \.,]" + word.lower() + "[ \.,]", text.lower()):
-                score += 1
-                words_of_interest.append(word)
-            elif re.search("[ \.,]" + word.lower() + "$", text.lower()):
-                score += 1
-                words_of_interest.append(word)
-            elif re.search("^" + word.lower() + "[ \.,]", text.lower()):
-                score += 1
-                words_of_interest.append(word)
+        if INTEREST_MATCHER is not None:
+            words_of_interest = INTEREST_MATCHER.match(text)
+        score = len(words_of_interest)
         logger.debug('"%s" [SCORE: %s]', text, score)
 
         if score == 0:
@@ -153,220 +1790,570 @@ class NewsBot:
         '''
         It removes characters with accent in order to create a nice
         site alias on WordPress in lower case.
+        Only [a-z0-9-] is kept, the way WordPress cleans the slugs
+        (sanitize_title), so the slug sent is the one the post gets.
         '''
-        new_line = line.lower()
-        new_line = re.sub(" ", "-", new_line)
-        new_line = re.sub("á|ã|å", "a", new_line)
-        new_line = re.sub("ó|õ|ö", "o", new_line)
-        new_line = re.sub("í|ï", "i", new_line)
-        new_line = re.sub("ç", "c", new_line)
-        return new_line
+        new_line = unicodedata.normalize('NFKD', line.lower())
+        new_line = new_line.encode('ascii', 'ignore').decode('ascii')
+        new_line = new_line.replace(".", "-")
+        new_line = re.sub(r"[^a-z0-9\s_-]", "", new_line)
+        new_line = re.sub(r"[\s_-]+", "-", new_line)
+        return new_line.strip("-")
 
     def publishPicture(self, image_link, url, token): #pylint: disable=C0103
         '''
         Publish the picture into WordPress site.
+        Images already uploaded (same url or same content) are reused.
+        The image is only kept in memory, without temporary files.
         '''
-        image_type = getImageExtension(image_link)
-        if image_type is None:
-            logger.debug("publishPicture() got image_type as none for: %s", image_link)
-            return None
-        logger.debug('image: %s', image_link)
-        try:
+        with self.stats.timer('publish_picture'):
+            return self.upload_picture(image_link, url, token)
 
-            image_path = getImage(image_link)
-        except requests.exceptions.InvalidSchema:
-            logger.error("detected invalid schema for image url: %s", image_link)
-            return None
-        logger.debug('image_path: %s', image_path)
-        with open(image_path, "rb") as img:
-            image_data = img.read()
-        image_filename = os.path.basename(image_path)
+    def upload_picture(self, image_link, url, token):
+        'publishPicture() itself'
+        logger.debug('image: %s', image_link)
+        with self.media_index.uploading('url:' + image_link):
+            media_id = self.media_index.by_url(image_link)
+            if media_id is not None:
+                logger.info('Reusing media %d for: %s', media_id, image_link)
+                self.stats.count('cache_media_url_hit')
+                return media_id
+            try:
+                with openImage(image_link, self.images['max_bytes']) as image:
+                    if image is None:
+                        return None
+            except requests.exceptions.InvalidSchema:
+                logger.error("detected invalid schema for image url: %s", image_link)
+                return None
+            self.stats.count('image_bytes', image.size)
+            digest = hashlib.sha256(image.data).hexdigest()
+            with self.media_index.uploading('hash:' + digest[:MEDIA_HASH_SIZE]):
+                media_id = self.media_index.by_hash(digest)
+                if media_id is not None:
+                    logger.info('Reusing media %d (same content) for: %s', media_id, image_link)
+                    self.stats.count('cache_media_content_hit')
+                    self.media_index.add(image_link, digest, media_id)
+                    return media_id
+                return self.upload_image(image, digest, url, token)
+
+    def upload_image(self, image : DownloadedImage, digest : str, url : str, token : str):
+        'Send a new image to WordPress and record it in the media index'
+        image_link = image.link
+        if self.images['process']:
+            image = self.processImage(image)
+            if image is None:
+                return None
+        image_filename = imageFilename(image_link, image.image_type, digest)
 
         logger.debug('image_filename: %s', image_filename)
-        logger.debug('image_type: %s', image_type)
+        logger.debug('image_type: %s', image.image_type)
 
         media_headers = {
             "Authorization": "Bearer " + token,
             "Content-Disposition": f"attachment; filename={image_filename}",
             "Cache-control" : "no-cache",
-            "Content-type" : image_type
+            "Content-type" : image.image_type
             }
 
-        media_response = requests.post(
+        media_response = get_http_session().post(
             url + "/wp-json/wp/v2/media",
             headers=media_headers,
-            data=image_data,
+            data=image.data,
             timeout=30
         )
+        self.stats.count('upload_bytes', image.size)
         # too much data
         #logger.debug('media_response: ' + media_response.text)
         media_id = None
         if media_response.status_code in (200, 201):
             media_id = media_response.json()["id"]
+            self.media_index.add(image_link, digest, media_id)
         else:
             logger.error("Failed to post picture: " +  #pylint: disable=W1201
-                           "%s, path: %s, status_code: %d",
-                image_link, image_path, media_response.status_code
+                           "%s, status_code: %d",
+                image_link, media_response.status_code
             )
-        logger.debug('removing image: %s', image_path)
-        os.unlink(image_path)
         return media_id
 
+    def rebuildMediaIndex(self): #pylint: disable=C0103
+        '''
+        Fill the media index from the images already in WordPress, using
+        the content hash that is part of their file names.
+        '''
+        url = self.wordpress['site']
+        headers = self.generate_http_headers(self.wordpress['token'])
+        page = 1
+        found = 0
+        while True:
+            try:
+                resp = get_http_session().get(f"{url}/wp-json/wp/v2/media", headers=headers,
+                    params={'per_page': 100, 'page': page, '_fields': 'id,source_url'},
+                    timeout=30)
+            except requests.exceptions.RequestException as e:
+                # not marked as rebuilt, so it is tried again in the next run
+                logger.error('Failed to rebuild the media index: %s', e)
+                return
+            if resp.status_code != 200:
+                logger.error('Failed to rebuild the media index: %d', resp.status_code)
+                return
+            for media in resp.json():
+                match = MEDIA_HASH_RE.search(media.get('source_url', ''))
+                if match:
+                    self.media_index.add(None, match.group(1), media['id'])
+                    found += 1
+            if page >= int(resp.headers.get('X-WP-TotalPages', page)):
+                break
+            page += 1
+        self.media_index.rebuilt()
+        logger.info('Media index rebuilt with %d images', found)
+
+    def syncPostIndex(self): #pylint: disable=C0103
+        '''
+        Bring the index of the published posts up to date: all of them the
+        first time, then only the ones modified since the last sync (usually
+        a single small request).
+        '''
+        url = self.wordpress['site']
+        headers = self.generate_http_headers(self.wordpress['token'])
+        params = {
+            'per_page' : 100,
+            '_fields' : 'id,slug,title,date,modified,content',
+            # oldest first, so an interrupted sync resumes where it stopped
+            'orderby' : 'modified',
+            'order' : 'asc',
+        }
+        modified = self.post_index.last_modified()
+        if modified is not None:
+            params['modified_after'] = modified
+        page = 1
+        found = 0
+        with self.stats.timer('post_index'):
+            while True:
+                try:
+                    resp = get_http_session().get(f"{url}/wp-json/wp/v2/posts", headers=headers,
+                        params=dict(params, page=page), timeout=30)
+                except requests.exceptions.RequestException as e:
+                    logger.error('Failed to update the published posts index: %s', e)
+                    break
+                if resp.status_code != 200:
+                    logger.error('Failed to update the published posts index: %d',
+                        resp.status_code)
+                    break
+                posts = resp.json()
+                self.post_index.add(posts)
+                found += len(posts)
+                if page >= int(resp.headers.get('X-WP-TotalPages', page)):
+                    break
+                page += 1
+        self.stats.count('post_index_updated', found)
+        logger.debug('%d posts added/updated in the published posts index', found)
+
+    def processImage(self, image : DownloadedImage) -> DownloadedImage: #pylint: disable=C0103
+        '''
+        Downscale/re-encode the image in the image processing pool.
+        It returns None if the image is too small to be used.
+        '''
+        with self.image_pool_lock:
+            if self.image_pool is None:
+                self.image_pool = newProcessPool(self.images['workers'])
+        result = self.image_pool.submit(transcodeImage, image.data, image.image_type,
+            self.images['max_dimension'], self.images['min_dimension'],
+            self.images['format'], self.images['quality']).result()
+        if result is None:
+            logger.info('Image too small: %s', image.link)
+            return None
+        data, image_type = result
+        logger.debug('image %s: %d bytes (%s) -> %d bytes (%s)', image.link,
+            image.size, image.image_type, len(data), image_type)
+        return DownloadedImage(image.link, image_type, data)
+
+    def stopImagePool(self): #pylint: disable=C0103
+        'To stop the image processing workers'
+        with self.image_pool_lock:
+            if self.image_pool is not None:
+                self.image_pool.shutdown()
+                self.image_pool = None
+
+    def cpuPool(self) -> ProcessPoolExecutor: #pylint: disable=C0103
+        'The parsing/summary workers, started on first use'
+        with self.cpu_pool_lock:
+            if self.cpu_pool is None:
+                self.cpu_pool = newProcessPool(self.cpu['workers'], initCpuWorker, (self.http,))
+            return self.cpu_pool
+
+    def stopCpuPool(self): #pylint: disable=C0103
+        'To stop the parsing/summary workers'
+        with self.cpu_pool_lock:
+            if self.cpu_pool is not None:
+                self.cpu_pool.shutdown()
+                self.cpu_pool = None
+
     def run(self):
         '''
         Simple bot starting point.
         '''
-        self.getHackerNews()
-        #prettyprint(self.articles)
-
-        self.articles = self.getArticles()
-        #prettyprint(self.articles)
-
-        self.publishWordPress()
-
-    def getHackerNews(self) -> list: # pylint: disable=C0103
+        self.articles = []
+        self.stats = RunStats()
+        try:
+            self.retryOutbox()
+            if not self.getNews():
+                logger.info('No news since the last run')
+                # keep when the feeds were checked, for their polling interval
+                self.feed_cache.save()
+                return
+            self.discardSeenArticles()
+            #prettyprint(self.articles)
+
+            self.articles = self.getArticles()
+            #prettyprint(self.articles)
+
+            results = self.publishWordPress()
+            outcomes = Counter(result['status'] for result in results)
+            logger.info('Published: %s', ', '.join(
+                f'{status}={count}' for status, count in sorted(outcomes.items())) or 'nothing')
+            self.feed_cache.save()
+        finally:
+            self.stats.finish()
+            self.saveRunReport()
+
+    def saveRunReport(self): # pylint: disable=C0103
+        'Export the telemetry of the run, as configured in the [TELEMETRY] section'
+        if self.telemetry['json']:
+            save_json(self.telemetry['json'], self.stats.report())
+        if self.telemetry['prometheus']:
+            save_text(self.telemetry['prometheus'], self.stats.prometheus())
+
+    def close(self):
+        'To release the worker processes and databases'
+        self.stopImagePool()
+        self.stopCpuPool()
+        self.seen.close()
+        self.media_index.close()
+        self.near_duplicates.close()
+        self.article_cache.close()
+        self.outbox.close()
+        self.post_index.close()
+        if self.translator.cache is not None:
+            self.translator.cache.close()
+
+    def getNews(self) -> list: # pylint: disable=C0103
         '''
-        get the news from rss and return as dict
+        get the news from the feeds due for polling, all of them in
+        parallel, and return them as Article.
+        It returns the new entries, empty if no feed changed.  An article
+        found in several feeds (same normalized link) is kept only once.
         '''
-        fp = feedparser.parse(HACKERNEWS_FEED)
-
-        for e in fp['entries']:
-            self.articles.append({
-                'title' : e['title'],
-                'link' : e['link'],
-            })
+        now = time.time()
+        due = [ feed for feed in self.feeds
+            if self.feed_cache.is_due(feed['url'], feed['interval'], now) ]
+        if not due:
+            logger.debug('No feed to poll yet')
+            return []
+        with self.stats.timer('feed'):
+            with ThreadPoolExecutor(
+                    max_workers=min(self.fetch['feed_workers'], len(due))) as executor:
+                results = list(executor.map(self.poll_feed, due))
+
+        links = { normalize_link(article.link) for article in self.articles }
+        news = list()
+        for entries in results:
+            for e in entries:
+                link = normalize_link(e['link'])
+                if link in links:
+                    self.stats.count('discard_duplicate_link')
+                    continue
+                links.add(link)
+                news.append(Article(e['title'], e['link']))
+        self.articles.extend(news)
+        return news
+
+    def poll_feed(self, feed : dict) -> list:
+        'The entries of a feed, empty if it failed or did not change'
+        try:
+            entries, changed = self.feed_cache.fetch(feed['url'])
+        except requests.exceptions.RequestException as e:
+            logger.error('Failed to get the feed %s: %s', feed['name'], e)
+            self.stats.count('feed_failed')
+            return []
+        if not changed:
+            self.stats.count('cache_feed_hit')
+            return []
+        logger.debug('%d entries from %s', len(entries), feed['name'])
+        self.stats.count('feed_entries', len(entries))
+        return entries
+
+    def discardSeenArticles(self): # pylint: disable=C0103
+        'Remove the articles handled in previous runs'
+        new_articles = list()
+        for article in self.articles:
+            if self.seen.is_seen(article.link):
+                logger.debug('Already seen: %s', article.link)
+                self.stats.count('discard_already_seen')
+                continue
+            new_articles.append(article)
+        logger.info('%d new articles out of %d', len(new_articles), len(self.articles))
+        self.articles = new_articles
 
     def getArticles(self) -> list: # pylint: disable=C0103
         '''
         Open each news from the list, fetch the data and try to generate a summary.
         If succeed, then add to the list.
+        The downloads run in parallel (limited per host) and each article is
+        summarized as soon as its download completes.  Then all of them are
+        translated together.
         '''
-        articles = list()
+        candidates = list()
         for article in self.articles:
-            title = article['title']
+            title = article.title
             if not self.isTopicOfInterest(title):
                 logger.info('Not related to something we might like, so we skip: %s', title)
+                self.seen.mark(article.link, SeenStore.NOT_INTERESTING)
+                self.stats.count('discard_not_interesting')
                 continue
             logger.info('Interested article: %s', title)
+            candidates.append(article)
+
+        summarized = list()
+        # signatures of the articles accepted in an earlier run, not published
+        self.near_duplicates.pending.clear()
+        if not candidates:
+            return summarized
+
+        limiter = HostLimiter(self.fetch['per_host'])
+        pending = iter(candidates)
+        # only a window of downloads runs ahead of the summaries, so the
+        # page texts waiting for the main thread don't grow with the run
+        window = 2 * self.fetch['workers']
+        with ThreadPoolExecutor(max_workers=self.fetch['workers']) as executor:
+            futures = {}
+            while True:
+                for article in islice(pending, window - len(futures)):
+                    futures[executor.submit(self.fetch_article, article.link, limiter)] = article
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # no reference to the done futures is kept, so the page
+                    # text they hold is freed once the article is summarized
+                    article = futures.pop(future)
+                    try:
+                        fetched = future.result()
+                    except Exception: # pylint: disable=W0703
+                        # only this article fails, to be tried again in the next run
+                        logger.exception('Failed to fetch %s', article.link)
+                        self.stats.count('discard_fetch_failed')
+                        continue
+                    processed = self.summarize_fetched(article, *fetched)
+                    if processed is not None:
+                        summarized.append(processed)
+        return self.translate_articles(summarized)
+
+    def summarize_fetched(self, article : Article, article_text : str, image_urls : list,
+            summary : str) -> Article:
+        '''
+        Check a downloaded article against the ones already handled (same
+        or near duplicate content) and process it.  It returns the Article,
+        or None if it was discarded.
+        '''
+        if article_text is None:
+            # failed download, to be tried again in the next run
+            self.stats.count('discard_fetch_failed')
+            return None
+        digest = content_hash(article_text)
+        if article_text and self.seen.is_content_seen(digest):
+            logger.info('Same content already handled: %s (DISCARDED)', article.title)
+            self.seen.mark(article.link, SeenStore.REJECTED, digest)
+            self.stats.count('discard_same_content')
+            return None
+        with self.stats.timer('near_duplicate'):
+            signature = self.near_duplicates.signature(article_text)
+            duplicate = self.near_duplicates.find(article.link, signature)
+        if duplicate is not None:
+            logger.info('Near duplicate of %s: %s (DISCARDED)', duplicate, article.title)
+            self.seen.mark(article.link, SeenStore.REJECTED, digest)
+            self.stats.count('discard_near_duplicate')
+            return None
+        article.hash = digest
+        processed = self.process_article(article, article_text, image_urls, summary)
+        if processed is not None:
+            # the same story from another source is dropped from now on,
+            # for good once this one is published
+            self.near_duplicates.hold(article.link, signature)
+        return processed
+
+    def fetch_article(self, link : str, limiter : HostLimiter) -> tuple:
+        '''
+        Download and parse an article, respecting the per host limit.
+        It returns (text, image urls, summary), the summary being None
+        unless the CPU pool is used: then the download, the parsing and
+        the summary all run in a worker process, and only their results
+        come back.
+        '''
+        if self.cpu['workers'] <= 0:
+            with limiter.limit(link):
+                return self.get_article_content_and_image(link) + (None,)
+        cached = self.cached_article(link)
+        if cached is not None and cached['fresh']:
+            return (cached['text'], cached['images'], self.pool_summary(cached['text']))
+        with limiter.limit(link):
+            fetched = self.cpuPool().submit(fetchAndSummarize, link, self.fetch['max_html_bytes'],
+                ArticleCache.conditional_headers(cached)).result()
+        self.stats.count('html_bytes', fetched['html_bytes'])
+        self.stats.add_time('fetch', fetched['fetch'])
+        if 'error' in fetched:
+            logger.error("Failed to fetch %s: %s", link, fetched['error'])
+            return (None, [], None)
+        if fetched['status'] == 304:
+            text, images = self.revalidated_article(link, cached, fetched)
+            return (text, images, self.pool_summary(text))
+        self.stats.add_time('parse', fetched['parse'])
+        self.stats.add_time('summarize', fetched['summarize'])
+        if fetched['status'] == 200:
+            self.article_cache.put(link, fetched['text'], fetched['images'], fetched['headers'])
+        return (fetched['text'], fetched['images'], fetched['summary'])
+
+    def pool_summary(self, text : str) -> str:
+        'Summary of an article from the cache, made in the CPU pool'
+        summary, seconds = self.cpuPool().submit(summarizeText, text).result()
+        self.stats.add_time('summarize', seconds)
+        return summary
+
+    def process_article(self, article : Article, article_text : str, image_urls : list,
+            summary : str = None) -> Article:
+        '''
+        Summarize a fetched article (unless it was already done).
+        It returns None when the article must be discarded.
+        '''
+        title = article.title
+        link = article.link
+        if summary is None:
+            with self.stats.timer('summarize'):
+                summary = self.generate_summary(article_text)
+
+        if self.is_summary_too_short(summary):
+        # if len(summary) < 5:
+            logger.info("Too short summary for: %s (DISCARDED)", title)
+            # summary too short, so skip to the next
+            self.seen.mark(link, SeenStore.REJECTED, article.hash)
+            self.stats.count('discard_too_short')
+            return None
 
-            link = article['link']
-            article_text, image_tags = self.get_article_content_and_image(link)
-            summary = self.generate_summary(article_text)
-
-            if self.is_summary_too_short(summary):
-            # if len(summary) < 5:
-                logger.info("Too short summary for: %s (DISCARDED)", title)
-                # summary too short, so skip to the next
-                continue
+        image_url = self.get_image_url_from_tag(title, image_urls)
 
-            image_url = self.get_image_url_from_tag(title, image_tags)
+        if image_url is None:
+            logger.warning("Discarding [%s] because of the missed image", title)
+            self.seen.mark(link, SeenStore.REJECTED, article.hash)
+            self.stats.count('discard_no_image')
+            return None
 
-            if image_url is None:
-                logger.warning("Discarding [%s] because of the missed image", title)
-                continue
+        article.summary = summary
+        article.image = image_url
+        return article
 
-            logger.info('translating: %s', title)
-            translated_summary = self.translate_article(summary)
+    def translate_articles(self, summarized : list) -> list:
+        '''
+        Translate titles and summaries of all the articles at once and
+        generate the content to be posted.
+        '''
+        if not summarized:
+            return []
+        logger.info('translating %d articles', len(summarized))
+        hits, misses = self.translator.hits, self.translator.misses
+        with self.stats.timer('translate'):
+            translations = self.translator.translate(
+                [ article.summary for article in summarized ] +
+                [ article.title for article in summarized ]
+            )
+        self.stats.count('cache_translation_hit', self.translator.hits - hits)
+        self.stats.count('translated_texts', self.translator.misses - misses)
+        translated_summaries = translations[:len(summarized)]
+        translated_titles = translations[len(summarized):]
 
+        articles = list()
+        for article, translated_summary, translated_title in zip(
+                summarized, translated_summaries, translated_titles):
+            title = article.title
             if translated_summary is None or len(translated_summary) < 5:
                 logger.error('failed to translate [%s]', title)
+                self.stats.count('discard_translation_failed')
+                continue
+            if translated_title is None:
+                logger.error('failed to translate title [%s]', title)
+                self.stats.count('discard_translation_failed')
                 continue
 
-            translated_title = self.translate_article(title)
-
-            content = self.generate_content_source(translated_summary, link)
-            articles.append({
-                'title': applyTextCorrections(translated_title),
-                'content': content,
-                'link': link,
-                'image': image_url
-            })
+            article.title = applyTextCorrections(translated_title)
+            article.content = self.generate_content_source(translated_summary, article.link)
+            article.summary = None
+            articles.append(article)
         return articles
 
-    def get_article_content_and_image(self, url : str) -> str:
-        'Fetch the text from url and return it after parsing'
+    def get_article_content_and_image(self, url : str) -> tuple:
+        '''
+        Fetch the text from url and return it after parsing, with the list
+        of image urls found (text is None if it failed).
+        The page is parsed while it is downloaded and the download stops
+        as soon as the article and an image were found.  What was extracted
+        is kept in the article cache.
+        '''
+        cached = self.cached_article(url)
+        if cached is not None and cached['fresh']:
+            return (cached['text'], cached['images'])
+        response_info = {}
+        started = time.perf_counter()
         try:
-            html_content = getHtmlContent(url)
-        except ConnectionError:
-            return ""
-        soup = BeautifulSoup(html_content, "html.parser")
-
-        article_text = ""
-        for element in soup.select("article p"):
-            article_text += "\n" + element.text
-
-        img_tags = soup.find_all('img')
-        return (article_text, img_tags)
-
+            text, images, parsing = extractArticle(url, self.fetch['max_html_bytes'], self.stats,
+                ArticleCache.conditional_headers(cached), response_info)
+        except (ConnectionError, requests.exceptions.RequestException) as e:
+            self.stats.add_time('fetch', time.perf_counter() - started)
+            logger.error("Failed to fetch %s: %s", url, e)
+            return (None, [])
+        # the page is parsed while it is downloaded
+        self.stats.add_time('fetch', time.perf_counter() - started - parsing)
+        self.stats.add_time('parse', parsing)
+        if response_info['status'] == 304:
+            return self.revalidated_article(url, cached, response_info)
+        if response_info['status'] == 200:
+            self.article_cache.put(url, text, images, response_info['headers'])
+        return (text, images)
+
+    def cached_article(self, url : str) -> dict:
+        'The article cache entry of url, if any'
+        cached = self.article_cache.get(url)
+        if cached is not None and cached['fresh']:
+            logger.debug('Article from the cache: %s', url)
+            self.stats.count('cache_article_hit')
+        return cached
+
+    def revalidated_article(self, url : str, cached : dict, response_info : dict) -> tuple:
+        'The cached (text, image urls) of a page that was not modified'
+        logger.debug('Article not modified: %s', url)
+        self.stats.count('cache_article_revalidated')
+        self.article_cache.refresh(url, response_info['headers'])
+        return (cached['text'], cached['images'])
 
     def translate_article(self, text: str) -> str:
         '''
         To translate the texts from English to Portuguese
         '''
-        try:
-            translated_content = translator.translate(text, src='en', dest='pt')
-        except TypeError:
-            logger.error("Translation failed for: %s", text)
-            return None
-        if translated_content.text == text:
-            logger.error("Translation failed: %s", translated_content.text)
-            return None
-        return translated_content.text
+        return self.translator.translate([ text ], src='en', dest='pt')[0]
 
     def generate_summary(self, article_text : str) -> str:
         '''
         Get the article and generate an automated summary.
         '''
-        try:
-            sentences = sent_tokenize(article_text)
-        except LookupError:
-            logger.info("initializing nltk")
-            nltk.download('punkt')
-            nltk.download('stopwords')
-
-            # trying again
-            sentences = sent_tokenize(article_text)
-
-        stop_words = set(stopwords.words("english"))
-        word_frequencies = FreqDist()
-        for word in nltk.word_tokenize(article_text):
-            if word.lower() not in stop_words:
-                word_frequencies[word.lower()] += 1
-
-        sentence_scores = {}
-        for sentence in sentences:
-            for word in nltk.word_tokenize(sentence.lower()):
-                if word in word_frequencies.keys():
-                    if len(sentence.split(" ")) < 30:
-                        if sentence not in sentence_scores:
-                            sentence_scores[sentence] = word_frequencies[word]
-                        else:
-                            sentence_scores[sentence] += word_frequencies[word]
-
-        summary_sentences = nlargest(
-            5, sentence_scores, key=sentence_scores.get)
-        return " ".join(summary_sentences)
+        return SUMMARIZER.summarize(article_text)
 
     def is_summary_too_short(self, summary: str) -> bool:
         'Is it shorter than 5 characters?'
         return len(summary) < 5
 
-    def get_image_url_from_tag(self, title: str, image_tags_from_soap: list):
+    def get_image_url_from_tag(self, title: str, image_urls: list):
         'Try to find a main image url'
-        if image_tags_from_soap is None:
+        if not image_urls:
             logger.error("The [%s] has no image tags", title)
             return None
-
-        tags_size = len(image_tags_from_soap)
-        if tags_size == 0:
-            logger.error("The [%s] has no image tags", title)
-            return None
-        try:
-            img_url = image_tags_from_soap[0]['src']
-            return img_url
-        except (KeyError, IndexError):
-            logger.error("Failed to find image for: [%s] - tags found: %d", title, tags_size)
-            return None
+        return image_urls[0]
 
     def generate_content_source(self, summary: str, link: str) -> str :
         '''to generate the content to be posted with source information'''
@@ -374,63 +2361,227 @@ class NewsBot:
             "\n\nFonte: <a href=\"" + link + \
             "\">" + link + "</a>"
 
-    def publishWordPress(self): #pylint: disable=C0103
+    def publishWordPress(self) -> list: #pylint: disable=C0103
         '''
         Publish articles into WordPress website.
+        Each article uploads its picture and then creates its post, with
+        several articles handled in parallel.  It returns one result dict
+        per article (title, link, status, media_id, post_id).
         '''
 
         # reference: https://github.com/crifan/crifanLibPython/blob/master/python3/crifanLib/thirdParty/crifanWordpress.py #pylint: disable=C0301
 
-        url = self.wordpress['site']
-        token = self.wordpress['token']
+        with self.stats.timer('publish'):
+            results = self.publish_articles()
+        for result in results:
+            self.stats.count('publish_' + result['status'])
+        return results
 
-        cur_headers = self.generate_http_headers(token)
-
-        published_titles = self.getSiteRSSTitles()
+    def publish_articles(self) -> list:
+        'publishWordPress() itself'
+        if self.articles:
+            self.syncPostIndex()
 
+        results = list()
+        to_publish = list()
         for art in self.articles:
-            if art['image'] is None:
-                logger.info("article [%s] missing image", art['title'])
-                continue
-
-            if self.is_article_already_published(art, published_titles):
+            if art.image is None:
+                logger.info("article [%s] missing image", art.title)
+                results.append(self.publish_result(art, PUBLISH_MISSING_IMAGE))
                 continue
 
-            data = {
-                "title": art['title'],
-                "content": art['content'],
-                "date": None, # '2020-08-17T10:16:34'
-                "slug": self.generateAlias(art['title']),
-                "status": "publish",
-                "format": 'standard',
-                "categories": [91], # 91 : notícias
-                "tags": [],
-            }
-
-            image_type = getImageExtension(art['image'])
-            if image_type is None:
-                logger.info("Failed to detect image extension [%s] (not published for this reason)", art['title'])
+            if self.is_article_already_published(art):
+                self.seen.mark(art.link, SeenStore.PUBLISHED, art.hash)
+                results.append(self.publish_result(art, PUBLISH_ALREADY_PUBLISHED))
                 continue
+            to_publish.append(art)
+
+        if not to_publish:
+            return results
+
+        if not self.media_index.is_rebuilt():
+            self.rebuildMediaIndex()
+
+        with ThreadPoolExecutor(max_workers=self.publish['workers']) as executor:
+            futures = [ executor.submit(self.publish_article, art) for art in to_publish ]
+            for future, art in zip(futures, to_publish):
+                result = future.result()
+                if result['status'] == PUBLISH_POSTED:
+                    self.seen.mark(art.link, SeenStore.PUBLISHED, art.hash)
+                    self.near_duplicates.add(art.link)
+                elif result['status'] == PUBLISH_QUEUED:
+                    # only the post is sent again, from the outbox
+                    self.seen.mark(art.link, SeenStore.QUEUED, art.hash)
+                    self.near_duplicates.add(art.link)
+                results.append(result)
+        return results
+
+    def publish_result(self, art : Article, status : str, media_id : int = None,
+            post_id : int = None) -> dict:
+        'The outcome of publishing an article'
+        return {
+            'title' : art.title,
+            'link' : art.link,
+            'status' : status,
+            'media_id' : media_id,
+            'post_id' : post_id
+        }
 
-            media_id = self.publishPicture(art['image'], url, token)
-            if  media_id is None:
-                logger.info("Failed to fetch image for [%s] (not published for this reason)", art['title'])
-                continue
-            data["featured_media"] = media_id
+    def publish_article(self, art : Article) -> dict:
+        '''
+        Upload the picture of an article and then create its post.
+        It runs in the publishing threads: any error only fails this
+        article, the others are still published and recorded.
+        '''
+        try:
+            return self.post_article(art)
+        except requests.exceptions.RequestException as e:
+            logger.error('FAILED: %s (%s)', art.title, e)
+        except Exception: # pylint: disable=W0703
+            logger.exception('FAILED: %s', art.title)
+        return self.publish_result(art, PUBLISH_FAILED)
+
+    def post_article(self, art : Article) -> dict:
+        'publish_article() itself'
+        url = self.wordpress['site']
+        token = self.wordpress['token']
 
-            resp = requests.post(
+        media_id = self.publishPicture(art.image, url, token)
+        if  media_id is None:
+            logger.info("Failed to fetch image for [%s] (not published for this reason)", art.title)
+            return self.publish_result(art, PUBLISH_IMAGE_FAILED)
+
+        post = {
+            'slug' : self.generateAlias(art.title),
+            'title' : art.title,
+            'content' : art.content,
+            'image' : art.image,
+            'media_id' : media_id,
+            'link' : art.link,
+            'hash' : art.hash,
+        }
+        post_id = self.send_post(post)
+        if post_id is not None:
+            logger.info('Posted: %s', art.title)
+            return self.publish_result(art, PUBLISH_POSTED, media_id, post_id)
+        logger.info('Queued to be sent again: %s', art.title)
+        self.outbox.add(post)
+        return self.publish_result(art, PUBLISH_QUEUED, post['media_id'])
+
+    def send_post(self, post : dict):
+        '''
+        Create the post in WordPress and return its id, None if it failed.
+        '''
+        url = self.wordpress['site']
+        data = {
+            "title": post['title'],
+            "content": post['content'],
+            "date": None, # '2020-08-17T10:16:34'
+            "slug": post['slug'],
+            "status": "publish",
+            "format": 'standard',
+            "categories": [91], # 91 : notícias
+            "tags": [],
+            "featured_media": post['media_id'],
+        }
+        try:
+            resp = get_http_session().post(
                 f"{url}/wp-json/wp/v2/posts",
-                headers=cur_headers,
+                headers=self.generate_http_headers(self.wordpress['token']),
                 # data=json.dumps(postDict),
                 json=data, # internal auto do json.dumps
                 timeout=30,
             )
-            if resp.status_code in (200, 201):
-                logger.info('Posted: %s', art['title'])
+        except requests.exceptions.RequestException as e:
+            logger.error('FAILED: %s (%s)', post['title'], e)
+            return None
+        logger.debug(' * status code: %s', str(resp.status_code))
+        #print(' * resp text:', resp.text)
+        if resp.status_code in (200, 201):
+            return resp.json().get('id')
+        logger.error('FAILED: %s (status code: %d)', post['title'], resp.status_code)
+        if resp.status_code == 400 and self.error_code(resp) == 'rest_invalid_featured_media':
+            # the reused media was removed from WordPress: it is uploaded
+            # again for the next attempt
+            self.media_index.forget(post['media_id'])
+            post['media_id'] = None
+        return None
+
+    @staticmethod
+    def error_code(resp) -> str:
+        'The "code" of a WordPress REST API error response, None if there is none'
+        try:
+            return resp.json().get('code')
+        except ValueError:
+            return None
+
+    def find_post_by_slug(self, slug : str, link : str):
+        '''
+        The id of the WordPress post with this slug (or the slug WordPress
+        gives when it is taken, "-2"...) and this source link, None if
+        there is none.
+        A failed attempt may have created the post anyway (e.g. a timeout
+        after WordPress got it), so a post is looked for before sending it
+        again.
+        '''
+        # WordPress splits the slug parameter on commas
+        slugs = [ slug ] + [ f"{slug}-{suffix}" for suffix in range(2, 6) ]
+        resp = get_http_session().get(f"{self.wordpress['site']}/wp-json/wp/v2/posts",
+            params={'slug': ",".join(slugs), '_fields': 'id,content'},
+            headers=self.generate_http_headers(self.wordpress['token']), timeout=30)
+        resp.raise_for_status()
+        link = normalize_link(link)
+        for post in resp.json():
+            # the same slug may be another article's
+            if PostIndex.source(post) == link:
+                return post['id']
+        return None
+
+    def retryOutbox(self) -> list: #pylint: disable=C0103
+        '''
+        Send again the posts of the outbox that are due, in parallel.  It
+        returns the results of the posts published.
+        '''
+        due = self.outbox.due()
+        if not due:
+            return []
+        logger.info('%d posts to send again', len(due))
+        with self.stats.timer('outbox'):
+            with ThreadPoolExecutor(max_workers=self.publish['workers']) as executor:
+                results = list(executor.map(self.resend_post, due))
+        published = list()
+        for post, result in zip(due, results):
+            if result is not None:
+                self.seen.mark(post['link'], SeenStore.PUBLISHED, post['hash'])
+                published.append(result)
+        return published
+
+    def resend_post(self, post : dict) -> dict:
+        'One retry of an outbox post, its result if it was published'
+        post_id = None
+        try:
+            post_id = self.find_post_by_slug(post['slug'], post['link'])
+            if post_id is not None:
+                logger.info('Already posted: %s', post['title'])
             else:
-                logger.error('FAILED: %s', art['title'])
-            logger.debug(' * status code: %s', str(resp.status_code))
-            #print(' * resp text:', resp.text)
+                if post['media_id'] is None:
+                    post['media_id'] = self.publishPicture(post['image'],
+                        self.wordpress['site'], self.wordpress['token'])
+                if post['media_id'] is not None:
+                    post_id = self.send_post(post)
+        except requests.exceptions.RequestException as e:
+            logger.error('FAILED: %s (%s)', post['title'], e)
+        if post_id is None:
+            self.stats.count('outbox_failed')
+            if not self.outbox.failed(post):
+                logger.error('Giving up on: %s', post['title'])
+                self.stats.count('outbox_abandoned')
+            return None
+        logger.info('Posted: %s', post['title'])
+        self.stats.count('outbox_posted')
+        self.outbox.posted(post['slug'], post_id)
+        return self.publish_result(Article(post['title'], post['link']), PUBLISH_POSTED,
+            post['media_id'], post_id)
 
     def generate_http_headers(self, token: str) -> str:
         'self explained method'
@@ -440,32 +2591,114 @@ class NewsBot:
             "Accept": "application/json",
         }
 
-    def is_article_already_published(self, article_dict: dict, published_titles: list) -> bool:
+    def is_article_already_published(self, article: Article) -> bool:
         'self explained method'
-        title = article_dict['title']
-        if title in published_titles:
+        title = article.title
+        if self.post_index.has_title(title) or self.post_index.has_source(article.link):
             logger.info('Article [%s] already published', title)
             return True
         return False
 
 
+class NewsDaemon:
+    '''
+    Keeps a NewsBot (and its caches, sessions and interest matcher) alive
+    and runs it every INTERVAL seconds plus a random JITTER.  The interests
+    list and the configuration are reloaded when they change, and
+    SIGTERM/SIGINT stop it once the current run is over.
+    '''
+    def __init__(self, config : str):
+        self.config = config
+        self.stop_event = threading.Event()
+        self.mtimes = {}
+        get_interested_terms()
+        self.bot = NewsBot(config=config)
+        # to know the current modification times
+        self.changed(INTERESTED_TERMS_FILE)
+        self.changed(config)
+
+    def changed(self, path : str) -> bool:
+        'Was the file modified since the last check?'
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        previous = self.mtimes.get(path)
+        self.mtimes[path] = mtime
+        return previous is not None and previous != mtime
+
+    def reload(self):
+        '''
+        Reload what was changed since the last run.  The new interests and
+        configuration are only used once they are read without errors.
+        '''
+        if self.changed(INTERESTED_TERMS_FILE):
+            logger.info('Reloading %s', INTERESTED_TERMS_FILE)
+            get_interested_terms()
+        if self.changed(self.config):
+            logger.info('Reloading %s', self.config)
+            bot = NewsBot(config=self.config)
+            self.bot.close()
+            self.bot = bot
+
+    def stop(self, signum=None, frame=None): # pylint: disable=W0613
+        'Signal handler: stop after the current run'
+        logger.info('Stopping')
+        self.stop_event.set()
+
+    def run(self):
+        'Poll until stopped'
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stop_event.is_set():
+            try:
+                self.reload()
+            except Exception: # pylint: disable=W0718
+                # a file saved half written or with a typo: tried again
+                # once it changes
+                logger.exception('Reload failed, keeping the current settings')
+            logger.info('Starting at: %s', time.ctime())
+            try:
+                self.bot.run()
+            except Exception: # pylint: disable=W0718
+                logger.exception('Run failed')
+            delay = self.bot.daemon['interval'] + random.uniform(0, self.bot.daemon['jitter'])
+            logger.debug('Next run in %.1f seconds', delay)
+            self.stop_event.wait(delay)
+        self.bot.close()
+        logger.info('Stopped at: %s', time.ctime())
+
+
 if __name__ == '__main__':
     import argparse
 
     parse = argparse.ArgumentParser(
         description='Automated Bot to Post into WordPress sites')
-    parse.add_argument('--config', required=True, help="configuration file")
+    parse.add_argument('--config', help="configuration file")
     parse.add_argument('--loglevel', help="logging level", default="DEBUG")
+    parse.add_argument('--prepare', action='store_true',
+        help="download the NLTK data and exit (to run at image build time)")
+    parse.add_argument('--daemon', action='store_true',
+        help="keep running and polling the news (see the [DAEMON] config section)")
 
     args = parse.parse_args()
+    if args.prepare:
+        prepare()
+        sys.exit(0)
+
     if args.config is None:
         raise Exception('Missing --config')
 
     if args.loglevel is not None:
         logger.setLevel(args.loglevel.upper())
 
+    if args.daemon:
+        NewsDaemon(args.config).run()
+        sys.exit(0)
+
     get_interested_terms()
 
     logger.info('Starting at: %s', time.ctime())
     news = NewsBot(config=args.config)
     news.run()
+    news.close()
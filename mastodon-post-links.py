@@ -5,7 +5,9 @@ import os
 import json
 import argparse
 import sys
-from mastodon import Mastodon
+import time
+from concurrent.futures import ThreadPoolExecutor
+from mastodon import Mastodon, MastodonError
 import requests
 import feedparser
 import re
@@ -22,90 +24,181 @@ DBM = "f{HOME}/.config/linux-br.org-autonews-bot/mastodon-posts.db"
 # mastodon limits toots to 550 characters
 POST_LIMIT_SIZE = 550
 
-def sleepMinutes(minutes):
-    import time
-    print(f'Sleeping {minutes} minutes')
-    time.sleep(minutes * 60)
+# status of the toots in the post_queue table
+QUEUE_PENDING = 'pending'
+QUEUE_POSTED = 'posted'
+QUEUE_ABANDONED = 'abandoned'
 
-def randomMinutes(maximum : int) -> int:
-    import random
-    return random.randint(0, maximum)
+# a toot failing this many times is given up
+POST_MAX_ATTEMPTS = 5
+# seconds before trying a failed toot again, doubled at each failure
+POST_RETRY_BACKOFF = 15 * 60
+
+def tootText(title : str, link : str) -> str:
+    # the title is truncated so the toot fits in POST_LIMIT_SIZE
+    suffix = f"\n\n {link}"
+    available = POST_LIMIT_SIZE - len(suffix)
+    if len(title) > available:
+        title = title[:available - 1].rstrip() + "…"
+    return title + suffix
 
 class TootPostLink:
-    def __init__(self, userid, database):
+    def __init__(self, userids, database):
         with open(CONFIG) as tootConfig:
             config = json.load(tootConfig)
 
-        self.mastodon = Mastodon(
-            access_token = config['users'][userid]['access_token'], 
-            api_base_url = config['users'][userid]['instance']
-            )
-        self.me = self.mastodon.me()
-        print('Mastodon login completed')
+        self.accounts = {}
+        for userid in userids:
+            # "pace" spreads the requests according to the rate limit
+            # headers sent by the instance, instead of hitting the limit
+            self.accounts[userid] = Mastodon(
+                access_token = config['users'][userid]['access_token'],
+                api_base_url = config['users'][userid]['instance'],
+                ratelimit_method = 'pace'
+                )
+            self.accounts[userid].me()
+            print(f'Mastodon login completed: {userid}')
 
         self.database = database
+        self.feed_validators = None
         self.getDataDB()
 
+    def getFeedValidators(self):
+        # ETag/Last-Modified from the last time the feed was downloaded
+        with sqlite3.connect(self.database) as con:
+            cur = con.cursor()
+            cur.execute("CREATE TABLE IF NOT EXISTS feed_cache " +
+                "(url TEXT PRIMARY KEY, etag TEXT, modified TEXT)")
+            row = cur.execute("SELECT etag, modified FROM feed_cache WHERE url = ?",
+                (RSS_SITE,)).fetchone()
+        if row is None:
+            return None, None
+        return row
+
     def getArticles(self):
-        # read articles from rss link
-        articles = feedparser.parse(RSS_SITE)
+        # read articles from rss link (conditional GET, nothing to do if not modified)
+        etag, modified = self.getFeedValidators()
+        articles = feedparser.parse(RSS_SITE, etag=etag, modified=modified)
         self.articles = []
+        if articles.get('status') == 304:
+            print('Feed not modified since the last run')
+            return
         print('selecting articles...')
-        print('posted_articles:')
-        for art in self.posted_articles:
-            print(" *", art)
-        for rss in articles.entries:
-            #rss = articles.entries[index]
-            if rss.link in self.posted_articles:
-                print(f'Article "{rss.title}" is already posted')
-                continue
-            print('title:', rss.title)
-            print(' * link:', rss.link)
-            self.articles.append([rss.title, rss.link])
+        with sqlite3.connect(self.database) as con:
+            for rss in articles.entries:
+                #rss = articles.entries[index]
+                if self.isPosted(con, rss.link):
+                    print(f'Article "{rss.title}" is already posted')
+                    continue
+                print('title:', rss.title)
+                print(' * link:', rss.link)
+                self.articles.append([rss.title, rss.link])
+        # only saved along with the queued articles, so a crash doesn't skip them
+        self.feed_validators = (articles.get('etag'), articles.get('modified'))
         print('done!')
 
-    def postMastodon(self):
-        print('Posting articles')
-
-        while self.articles:
-            title, link = self.articles.pop()
-            sleepMinutes(randomMinutes(3))
-            print(f'Posting: {title}')
-            self.mastodon.toot(f"{title}\n\n {link}")
-            self.posted_articles.append(link)
-
-    def saveDataDB(self):
-        print('Saving data')
+    def queueArticles(self):
+        # the new articles are queued for every account, together with the
+        # feed validators: from now on a crash doesn't lose or repeat them
+        print('Queueing articles')
         with sqlite3.connect(self.database) as con:
             cur = con.cursor()
-            for link in self.posted_articles:
-                cur.execute(f"INSERT into posted_articles values (\"{link}\") ")
+            # oldest first
+            for title, link in reversed(self.articles):
+                for userid in self.accounts:
+                    cur.execute("INSERT OR IGNORE INTO post_queue " +
+                        "(account, link, title, status, queued) VALUES (?, ?, ?, ?, ?)",
+                        (userid, link, title, QUEUE_PENDING, time.time()))
+                cur.execute("INSERT OR IGNORE INTO posted_articles VALUES (?)", (link,))
+            if self.feed_validators is not None:
+                etag, modified = self.feed_validators
+                cur.execute("INSERT OR REPLACE INTO feed_cache VALUES (?, ?, ?)",
+                    (RSS_SITE, etag, modified))
             con.commit()
+        self.articles = []
+
+    def postAccount(self, userid) -> int:
+        # post the queue of an account, each toot is recorded as soon as
+        # it is posted; failed ones are tried again in a later run, with
+        # a growing delay, until POST_MAX_ATTEMPTS
+        mastodon = self.accounts[userid]
+        with sqlite3.connect(self.database) as con:
+            pending = con.execute("SELECT title, link, attempts FROM post_queue " +
+                "WHERE account = ? AND status = ? AND (retry_at IS NULL OR retry_at <= ?) " +
+                "ORDER BY rowid", (userid, QUEUE_PENDING, time.time())).fetchall()
+        posted = 0
+        for title, link, attempts in pending:
+            print(f'Posting [{userid}]: {title}')
+            try:
+                mastodon.status_post(tootText(title, link))
+            except MastodonError as e:
+                print(f'ERROR: failed to post {link} [{userid}]: {e}')
+                self.postFailed(userid, link, attempts + 1)
+                continue
+            with sqlite3.connect(self.database) as con:
+                con.execute("UPDATE post_queue SET status = ?, posted = ? " +
+                    "WHERE account = ? AND link = ?",
+                    (QUEUE_POSTED, time.time(), userid, link))
+                con.commit()
+            posted += 1
+        return posted
+
+    def postFailed(self, userid, link, attempts):
+        if attempts >= POST_MAX_ATTEMPTS:
+            print(f'Giving up {link} [{userid}] after {attempts} attempts')
+            status, retry_at = QUEUE_ABANDONED, None
+        else:
+            status = QUEUE_PENDING
+            retry_at = time.time() + POST_RETRY_BACKOFF * 2 ** (attempts - 1)
+        with sqlite3.connect(self.database) as con:
+            con.execute("UPDATE post_queue SET status = ?, attempts = ?, retry_at = ? " +
+                "WHERE account = ? AND link = ?",
+                (status, attempts, retry_at, userid, link))
+            con.commit()
+
+    def postMastodon(self):
+        print('Posting articles')
+        # each account has its own rate limit, so they post in parallel
+        with ThreadPoolExecutor(max_workers=len(self.accounts)) as executor:
+            for userid, posted in zip(self.accounts,
+                    executor.map(self.postAccount, self.accounts)):
+                print(f'{posted} articles posted to {userid}')
+
+    def isPosted(self, con, link) -> bool:
+        # indexed lookup, the history is never loaded in memory
+        row = con.execute("SELECT 1 FROM posted_articles WHERE link = ?", (link,)).fetchone()
+        return row is not None
 
     def getDataDB(self):
         print('Getting data from DB')
-        self.posted_articles = []
         with sqlite3.connect(self.database) as con:
             cur = con.cursor()
-            for item in cur.execute("SELECT * from posted_articles").fetchall():
-                self.posted_articles.append(item[0])
-        # detect duplicates and fix
-        single_articles = sorted(set(self.posted_articles))
-        if len(self.posted_articles) > len(single_articles):
-            print("Duplicated entries into database deteced - fixing")
-            with sqlite3.connect(self.database) as con:
-                cur = con.cursor()
-                cur.execute("DELETE FROM posted_articles")
-                con.commit()
-            self.posted_articles = single_articles
-            self.saveDataDB()
-            print("Database fixed from duplicates")
-            
+            cur.execute("CREATE TABLE IF NOT EXISTS posted_articles (link TEXT)")
+            cur.execute("CREATE TABLE IF NOT EXISTS post_queue " +
+                "(account TEXT, link TEXT, title TEXT, status TEXT, queued REAL, posted REAL, " +
+                "attempts INTEGER DEFAULT 0, retry_at REAL, PRIMARY KEY (account, link))")
+            columns = [ row[1] for row in cur.execute("PRAGMA table_info(post_queue)") ]
+            if 'attempts' not in columns:
+                # queue created before the retries were limited
+                cur.execute("ALTER TABLE post_queue ADD COLUMN attempts INTEGER DEFAULT 0")
+                cur.execute("ALTER TABLE post_queue ADD COLUMN retry_at REAL")
+            index = cur.execute("SELECT 1 FROM sqlite_master " +
+                "WHERE type = 'index' AND name = 'posted_articles_link'").fetchone()
+            if index is None:
+                # older databases could have duplicated entries, removed
+                # once before the unique index is created
+                removed = cur.execute("DELETE FROM posted_articles WHERE rowid NOT IN " +
+                    "(SELECT MIN(rowid) FROM posted_articles GROUP BY link)").rowcount
+                if removed:
+                    print(f"Removed {removed} duplicated entries from the database")
+                cur.execute("CREATE UNIQUE INDEX posted_articles_link ON posted_articles (link)")
+            con.commit()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Runs through your following list and recommend them')
-    parser.add_argument("--userid", help="Your registered mastodon account at toot configuration")
+    parser.add_argument("--userid", nargs='+',
+        help="Your registered mastodon account(s) at toot configuration")
     parser.add_argument("--sqlite3", help="sqlite3 DB to store information")
     args = parser.parse_args()
 
@@ -123,6 +216,6 @@ if __name__ == '__main__':
 
     toot = TootPostLink(args.userid, args.sqlite3)
     toot.getArticles()
+    toot.queueArticles()
     toot.postMastodon()
-    toot.saveDataDB()
 
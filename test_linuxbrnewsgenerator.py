@@ -1,10 +1,46 @@
 #! /usr/bin/env python3
 import unittest
+import importlib.util
+import io
+import os
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import requests
 import linuxbrnewsgenerator as lxbr
 
 sys.dont_write_bytecode = True
 
+lxbr.get_interested_terms()
+
+def nltk_data_available():
+    'The summary tests need the punkt and stopwords NLTK data'
+    try:
+        lxbr.Summarizer().load(download=False)
+    except LookupError:
+        return False
+    return True
+
+def article(title, link, **fields):
+    'An Article with some of its fields already set'
+    new = lxbr.Article(title, link)
+    for name, value in fields.items():
+        setattr(new, name, value)
+    return new
+
+class StubTranslator:
+    'Offline translation backend'
+    def __init__(self):
+        self.calls = []
+
+    def translate(self, texts, src, dest):
+        self.calls.append(list(texts))
+        return [ f"[{dest}] {text}" for text in texts ]
+
 class TestLinuxBRNewsGenerator(unittest.TestCase):
     bot = lxbr.NewsBot("dot.config")
 
@@ -26,5 +62,833 @@ class TestLinuxBRNewsGenerator(unittest.TestCase):
         rank = self.bot.isTopicOfInterest("Das Schiff Is a GitOps Based Kubernetes Cluster as a Service Platform")
         self.assertEqual(rank, 1)
 
+    def test_InterestMatcher(self):
+        matcher = lxbr.InterestMatcher(["Linux", "C\\+\\+", "open source", "Debian", "Debian"])
+        self.assertEqual(matcher.match("Linux"), [])
+        self.assertEqual(matcher.match("Linux rocks"), ["Linux"])
+        self.assertEqual(matcher.match("I love linux"), ["Linux"])
+        self.assertEqual(matcher.match("Linuxy things"), [])
+        self.assertEqual(matcher.match("Modern C++, Debian and open source."),
+            ["C\\+\\+", "open source", "Debian", "Debian"])
+        self.assertEqual(lxbr.InterestMatcher([]).match("Linux rocks"), [])
+        # top level alternations may start with any of their alternatives
+        matcher = lxbr.InterestMatcher(["gnu|bsd", "(open|free)bsd", "a[|]b"])
+        self.assertEqual(matcher.match("Why bsd rocks"), ["gnu|bsd"])
+        self.assertEqual(matcher.match("freebsd rocks"), ["(open|free)bsd"])
+        self.assertEqual(matcher.match("a|b rocks"), ["a[|]b"])
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def newBot(self):
+        bot = lxbr.NewsBot("dot.config")
+        bot.seen = lxbr.SeenStore(os.path.join(self.tmpdir.name, 'seen.db'))
+        self.addCleanup(bot.seen.close)
+        cache = lxbr.TranslationCache(os.path.join(self.tmpdir.name, 'translations.db'))
+        self.addCleanup(cache.close)
+        bot.translator = lxbr.TranslationService(StubTranslator(), cache)
+        bot.media_index = lxbr.MediaIndex(os.path.join(self.tmpdir.name, 'media.db'))
+        self.addCleanup(bot.media_index.close)
+        # nothing to find in WordPress
+        bot.media_index.rebuilt()
+        bot.near_duplicates = lxbr.NearDuplicateIndex(
+            os.path.join(self.tmpdir.name, 'near_duplicates.db'))
+        self.addCleanup(bot.near_duplicates.close)
+        bot.article_cache = lxbr.ArticleCache(os.path.join(self.tmpdir.name, 'articles.db'))
+        self.addCleanup(bot.article_cache.close)
+        bot.outbox = lxbr.PublishOutbox(os.path.join(self.tmpdir.name, 'outbox.db'))
+        self.addCleanup(bot.outbox.close)
+        bot.post_index = lxbr.PostIndex(os.path.join(self.tmpdir.name, 'posts.db'))
+        self.addCleanup(bot.post_index.close)
+        return bot
+
+    def test_getArticles_concurrent(self):
+        bot = self.newBot()
+        bot.articles = [
+            article(f'Linux news {index}', f'https://site{index % 2}.org/{index}')
+            for index in range(6)
+        ] + [article('Smart Lasers for Bone Surgery', 'https://site0.org/lasers')]
+        running = {}
+        peak = {}
+        lock = threading.Lock()
+
+        def fake_fetch(link):
+            host = link.split('/')[2]
+            with lock:
+                running[host] = running.get(host, 0) + 1
+                peak[host] = max(peak.get(host, 0), running[host])
+            time.sleep(0.05)
+            with lock:
+                running[host] -= 1
+            return (f"text of {link}", [])
+
+        with mock.patch.object(bot, 'get_article_content_and_image', side_effect=fake_fetch), \
+            mock.patch.object(bot, 'process_article',
+                side_effect=lambda art, text, tags, summary=None: article(art.title, art.link,
+                    summary=text, image='https://site0.org/logo.png')):
+            articles = bot.getArticles()
+
+        self.assertEqual(sorted(a.link for a in articles),
+            sorted(a.link for a in bot.articles[:6]))
+        self.assertLessEqual(max(peak.values()), bot.fetch['per_host'])
+        # compact records: no per instance dict, summary dropped once translated
+        self.assertFalse(hasattr(articles[0], '__dict__'))
+        self.assertIsNone(articles[0].summary)
+        self.assertTrue(articles[0].content.startswith("[pt] text of "))
+
+    def test_getArticles_window(self):
+        bot = self.newBot()
+        bot.fetch['workers'] = 2
+        bot.fetch['per_host'] = 2
+        bot.articles = [ article(f'Linux news {index}', f'https://site.org/{index}')
+            for index in range(12) ]
+        fetched = []
+        ahead = []
+
+        def fake_fetch(link):
+            fetched.append(link)
+            return (f"text of {link}", [])
+
+        def slow_process(art, text, tags, summary=None):
+            # downloads are fast, summaries slow: the texts waiting are bounded
+            ahead.append(len(fetched) - len(ahead))
+            time.sleep(0.01)
+            return article(art.title, art.link, summary=text, image='https://site.org/logo.png')
+
+        with mock.patch.object(bot, 'get_article_content_and_image', side_effect=fake_fetch), \
+            mock.patch.object(bot, 'process_article', side_effect=slow_process), \
+            mock.patch.object(bot.near_duplicates, 'find', return_value=None):
+            articles = bot.getArticles()
+        self.assertEqual(len(articles), 12)
+        self.assertLessEqual(max(ahead), 2 * bot.fetch['workers'])
+
+    def test_getArticles_fetch_error(self):
+        bot = self.newBot()
+        bot.articles = [ article(f'Linux news {index}', f'https://site.org/{index}')
+            for index in range(3) ]
+
+        def fake_fetch(link):
+            if link.endswith('/1'):
+                raise lxbr.sqlite3.OperationalError("database is locked")
+            return (f"text of {link}", [])
+
+        with mock.patch.object(bot, 'get_article_content_and_image', side_effect=fake_fetch), \
+            mock.patch.object(bot, 'process_article',
+                side_effect=lambda art, text, tags, summary=None: article(art.title, art.link,
+                    summary=text, image='https://site.org/logo.png')), \
+            mock.patch.object(bot.near_duplicates, 'find', return_value=None):
+            articles = bot.getArticles()
+        self.assertEqual(sorted(a.link for a in articles),
+            ['https://site.org/0', 'https://site.org/2'])
+        self.assertEqual(bot.stats.counters['discard_fetch_failed'], 1)
+        self.assertFalse(bot.seen.is_seen('https://site.org/1'))
+
+    def test_http_session(self):
+        session = lxbr.configure_http_session(pool_size=4, retries=2, backoff=0.1)
+        self.assertIs(lxbr.get_http_session(), session)
+        adapter = session.get_adapter("https://linux-br.org")
+        self.assertEqual(adapter._pool_maxsize, 4) # pylint: disable=W0212
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertNotIn("POST", adapter.max_retries.allowed_methods)
+
+    def test_FeedCache(self):
+        rss = b"""<?xml version="1.0"?><rss version="2.0"><channel><title>HN</title>
+            <item><title>Linux 7.0 released</title><link>https://kernel.org/</link></item>
+            </channel></rss>"""
+        ok = mock.Mock(status_code=200, content=rss,
+            headers={'ETag': '"abc"', 'content-type': 'application/rss+xml'})
+        not_modified = mock.Mock(status_code=304, content=b"", headers={})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'feeds.json')
+            cache = lxbr.FeedCache(path)
+            session = mock.Mock()
+            session.get.side_effect = [ok, not_modified]
+            with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+                entries, changed = cache.fetch(lxbr.HACKERNEWS_FEED)
+                self.assertTrue(changed)
+                self.assertEqual(entries, [{'title': 'Linux 7.0 released', 'link': 'https://kernel.org/'}])
+                cache.save()
+
+                cache = lxbr.FeedCache(path)
+                cached_entries, changed = cache.fetch(lxbr.HACKERNEWS_FEED)
+            self.assertFalse(changed)
+            self.assertEqual(cached_entries, entries)
+            self.assertEqual(session.get.call_args.kwargs['headers'], {'If-None-Match': '"abc"'})
+
+    def test_getNews(self):
+        bot = self.newBot()
+        bot.feed_cache = lxbr.FeedCache(os.path.join(self.tmpdir.name, 'feeds.json'))
+        bot.feeds = [
+            {'name': 'hn', 'url': 'https://hn.org/rss', 'interval': 0},
+            {'name': 'lwn', 'url': 'https://lwn.net/rss', 'interval': 3600},
+            {'name': 'down', 'url': 'https://down.org/rss', 'interval': 0},
+        ]
+        entries = {
+            'https://hn.org/rss': [
+                {'title': 'Linux 7.0 released', 'link': 'https://kernel.org/7'},
+                {'title': 'Rust in the kernel', 'link': 'https://lwn.net/rust?utm_source=hn'},
+            ],
+            'https://lwn.net/rss': [
+                {'title': 'Rust in the kernel', 'link': 'https://LWN.net/rust/'},
+                {'title': 'Kernel news', 'link': 'https://lwn.net/news'},
+            ],
+        }
+        started = threading.Barrier(3, timeout=5)
+
+        def fake_fetch(link):
+            # all the feeds are downloaded at the same time
+            started.wait()
+            if link not in entries:
+                raise lxbr.requests.exceptions.ConnectionError("down")
+            bot.feed_cache.feeds[link] = {'checked': lxbr.time.time()}
+            return (entries[link], True)
+
+        with mock.patch.object(bot.feed_cache, 'fetch', side_effect=fake_fetch):
+            news = bot.getNews()
+        self.assertEqual([ article.link for article in news ],
+            ['https://kernel.org/7', 'https://lwn.net/rust?utm_source=hn', 'https://lwn.net/news'])
+        self.assertEqual(bot.stats.counters['discard_duplicate_link'], 1)
+        self.assertEqual(bot.stats.counters['feed_failed'], 1)
+
+        # lwn is not due again for an hour
+        entries['https://down.org/rss'] = []
+        started = threading.Barrier(2, timeout=5)
+        with mock.patch.object(bot.feed_cache, 'fetch', side_effect=fake_fetch) as fetch:
+            bot.getNews()
+        self.assertEqual(sorted(call.args[0] for call in fetch.call_args_list),
+            ['https://down.org/rss', 'https://hn.org/rss'])
+
+    def test_run_no_news_saves_feed_cache(self):
+        bot = self.newBot()
+        path = os.path.join(self.tmpdir.name, 'feeds.json')
+        lxbr.save_json(path, {'https://lwn.net/rss': {'etag': '"v1"', 'checked': 0,
+            'entries': [{'title': 'Kernel news', 'link': 'https://lwn.net/news'}]}})
+        bot.feed_cache = lxbr.FeedCache(path)
+        bot.feeds = [ {'name': 'lwn', 'url': 'https://lwn.net/rss', 'interval': 3600} ]
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=304, content=b"", headers={})
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session), \
+            mock.patch.object(bot, 'retryOutbox'):
+            bot.run()
+        # the feed is not due again on the next (cron) run
+        self.assertFalse(lxbr.FeedCache(path).is_due('https://lwn.net/rss', 3600))
+
+    def test_SeenStore(self):
+        bot = self.newBot()
+        bot.articles = [
+            article('Linux rocks', 'https://Site.org/a/?utm_source=hn#top'),
+            article('Rust rocks', 'https://site.org/b'),
+        ]
+        bot.seen.mark('https://site.org/a', lxbr.SeenStore.PUBLISHED, lxbr.content_hash("Same text"))
+        bot.discardSeenArticles()
+        self.assertEqual([a.link for a in bot.articles], ['https://site.org/b'])
+
+        with mock.patch.object(bot, 'get_article_content_and_image',
+                return_value=("  same TEXT ", [])), \
+            mock.patch.object(bot, 'process_article') as process:
+            self.assertEqual(bot.getArticles(), [])
+        process.assert_not_called()
+        self.assertTrue(bot.seen.is_seen('https://site.org/b/'))
+
+    def test_NearDuplicateIndex(self):
+        rnd = lxbr.random.Random(3)
+        words = [ f"word{index}" for index in range(500) ]
+        text = " ".join(rnd.choice(words) for _ in range(400))
+        edited = "Breaking: " + text.replace(text.split()[200], "changed", 1) + " Updated."
+        path = os.path.join(self.tmpdir.name, 'near.db')
+        index = lxbr.NearDuplicateIndex(path)
+        index.hold("https://lwn.net/story", index.signature(text))
+        index.hold("https://lwn.net/unpublished", index.signature(text))
+        # only published articles are stored, once for each link
+        index.add("https://lwn.net/story")
+        index.hold("https://lwn.net/story", index.signature(text))
+        index.add("https://lwn.net/story")
+        self.assertEqual(index.connection().execute(
+            "SELECT link, COUNT(*) FROM signatures GROUP BY link").fetchall(),
+            [("https://lwn.net/story", 1)])
+        self.assertEqual(index.connection().execute(
+            "SELECT COUNT(*) FROM bands").fetchone(), (index.bands,))
+        index.close()
+
+        index = lxbr.NearDuplicateIndex(path)
+        self.addCleanup(index.close)
+        self.assertEqual(index.find("https://news.org/same-story", index.signature(edited)),
+            "https://lwn.net/story")
+        # the same article, tried again
+        self.assertIsNone(index.find("https://LWN.net/story/", index.signature(edited)))
+        other = " ".join(rnd.choice(words) for _ in range(400))
+        self.assertIsNone(index.find("https://news.org/other", index.signature(other)))
+        self.assertIsNone(index.signature(" ... "))
+
+        bot = self.newBot()
+        bot.near_duplicates = index
+        bot.articles = [article('Linux story', 'https://news.org/same-story')]
+        with mock.patch.object(bot, 'get_article_content_and_image', return_value=(edited, [])), \
+            mock.patch.object(bot, 'process_article') as process:
+            self.assertEqual(bot.getArticles(), [])
+        process.assert_not_called()
+        self.assertEqual(bot.stats.counters['discard_near_duplicate'], 1)
+
+        # within a run, the articles accepted before are compared too
+        index.pending.clear()
+        bot.articles = [article('Linux story', 'https://news.org/first'),
+            article('Linux story again', 'https://news.org/second')]
+        with mock.patch.object(bot, 'get_article_content_and_image', return_value=(other, [])), \
+            mock.patch.object(bot, 'process_article', side_effect=lambda art, *args: art):
+            self.assertEqual([art.link for art in bot.getArticles()], ['https://news.org/first'])
+        self.assertEqual(bot.stats.counters['discard_near_duplicate'], 2)
+        self.assertIsNone(index.connection().execute(
+            "SELECT id FROM signatures WHERE link = 'https://news.org/first'").fetchone())
+
+        # signatures of an older version are dropped, not compared
+        index.close()
+        with mock.patch.object(lxbr.NearDuplicateIndex, 'SIGNATURE_VERSION', 3):
+            index = lxbr.NearDuplicateIndex(path)
+            self.assertIsNone(index.find("https://news.org/same-story", index.signature(edited)))
+            index.close()
+        self.assertTrue(bot.seen.is_seen('https://news.org/same-story'))
+
+    def test_TranslationService(self):
+        cache = lxbr.TranslationCache(os.path.join(self.tmpdir.name, 'translations.db'),
+            max_entries=2)
+        self.addCleanup(cache.close)
+        backend = StubTranslator()
+        service = lxbr.TranslationService(backend, cache)
+        self.assertEqual(service.translate(["one", "two", "one"]),
+            ["[pt] one", "[pt] two", "[pt] one"])
+        self.assertEqual(backend.calls, [["one", "two"]])
+        self.assertEqual(service.translate(["two", "three"]), ["[pt] two", "[pt] three"])
+        self.assertEqual(backend.calls[-1], ["three"])
+        # "one" was the least recently used
+        self.assertIsNone(cache.get("one", "en", "pt"))
+
+    def test_GoogleTranslateBackend_batches(self):
+        backend = lxbr.GoogleTranslateBackend(max_chars=20)
+        with mock.patch.object(backend, 'translate_one',
+                side_effect=lambda text, src, dest: text.upper()) as translate_one:
+            self.assertEqual(backend.translate(["first text", "second", "third one here"], 'en', 'pt'),
+                ["FIRST TEXT", "SECOND", "THIRD ONE HERE"])
+        self.assertEqual(translate_one.call_count, 2)
+
+    @unittest.skipUnless(nltk_data_available(), "NLTK data not installed")
+    def test_Summarizer(self):
+        text = "Linux rocks. Linux kernel rocks. It is. " + " ".join(["linux"] * 30) + "."
+        self.assertEqual(lxbr.Summarizer(size=2).summarize(text),
+            "Linux kernel rocks. Linux rocks.")
+        # sentences with 30 words or more are never used
+        self.assertEqual(lxbr.Summarizer().summarize(text),
+            "Linux kernel rocks. Linux rocks. It is.")
+
+    def test_lazy_imports(self):
+        loaded = subprocess.run([sys.executable, "-c",
+            "import sys, linuxbrnewsgenerator; " +
+            "print([m for m in ('nltk', 'googletrans', 'feedparser', 'bs4') if m in sys.modules])"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(loaded.stdout.strip(), "[]")
+
+    def test_get_article_content_and_image(self):
+        html = (b"<html><head><meta property='og:image' content='/hero.png'></head><body>"
+            b"<p>Not in the article</p><article><h1>Title</h1><p>First &amp; <b>bold</b></p>"
+            b"<p>Second</article>" + b"<p>filler</p>" * 10000 + b"</body></html>")
+        chunks = [ html[index:index + 1024] for index in range(0, len(html), 1024) ]
+        response = mock.MagicMock(headers={'content-type': 'text/html'})
+        response.__enter__.return_value = response
+        response.iter_content.return_value = iter(chunks)
+        session = mock.Mock()
+        session.get.return_value = response
+        bot = self.newBot()
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            text, images = bot.get_article_content_and_image("https://site.org/news/1")
+        self.assertEqual(text, "\nFirst & bold\nSecond")
+        self.assertEqual(images, ["https://site.org/hero.png"])
+        # stopped right after the article
+        self.assertLess(len(list(response.iter_content.return_value)), len(chunks))
+
+        # unknown charset: read as utf-8
+        response = mock.MagicMock(headers={'content-type': 'text/html; charset=utf8mb4'},
+            encoding='utf8mb4')
+        response.__enter__.return_value = response
+        response.iter_content.return_value = iter(
+            ["<article><p>Atualização</p></article>".encode('utf-8')])
+        session.get.return_value = response
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            text, images = bot.get_article_content_and_image("https://site.org/news/2")
+        self.assertEqual(text, "\nAtualização")
+
+    def test_fetch_article_cpu_pool(self):
+        html = ("<html><head><meta property='og:image' content='/hero.png'></head><body>"
+            "<article><p>First</p><p>Second</p></article></body></html><p>Ignored</p>")
+        bot = self.newBot()
+        bot.cpu['workers'] = 2
+        # same interface as the process pool, without needing the NLTK data
+        bot.cpu_pool = lxbr.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(bot.stopCpuPool)
+        limiter = lxbr.HostLimiter(1)
+        read = []
+
+        def fake_stream(url, max_bytes, stats, headers, response_info):
+            response_info.update(status=200, headers={'ETag': '"1"'})
+            for index in range(0, len(html), 16):
+                read.append(html[index:index + 16])
+                stats.count('html_bytes', 16)
+                yield html[index:index + 16]
+
+        submitted = []
+        submit = bot.cpu_pool.submit
+        def record_submit(function, *args):
+            submitted.append(function)
+            return submit(function, *args)
+
+        with mock.patch.object(lxbr, 'streamHtmlContent', side_effect=fake_stream), \
+            mock.patch.object(bot.cpu_pool, 'submit', side_effect=record_submit), \
+            mock.patch.object(lxbr.SUMMARIZER, 'summarize', side_effect=lambda text: "summary"):
+            result = bot.fetch_article("https://site.org/news/1", limiter)
+            # the worker downloaded and parsed the page itself, stopping early
+            self.assertEqual(submitted, [lxbr.fetchAndSummarize])
+            self.assertLess(len("".join(read)), len(html))
+            self.assertEqual(bot.stats.counters['html_bytes'], 16 * len(read))
+            self.assertEqual(result, ("\nFirst\nSecond", ["https://site.org/hero.png"], "summary"))
+            self.assertEqual(bot.stats.phases['summarize'][1], 1)
+            self.assertEqual(bot.article_cache.get("https://site.org/news/1")['etag'], '"1"')
+
+            # cached: neither downloaded nor parsed again, summarized in the pool too
+            downloaded = len(read)
+            self.assertEqual(bot.fetch_article("https://site.org/news/1", limiter),
+                ("\nFirst\nSecond", ["https://site.org/hero.png"], "summary"))
+            self.assertEqual(submitted, [lxbr.fetchAndSummarize, lxbr.summarizeText])
+            self.assertEqual(len(read), downloaded)
+
+        with mock.patch.object(lxbr, 'streamHtmlContent',
+                side_effect=lxbr.requests.exceptions.ConnectionError("down")):
+            self.assertEqual(bot.fetch_article("https://site.org/news/2", limiter),
+                (None, [], None))
+
+    @unittest.skipUnless(nltk_data_available(), "NLTK data not installed")
+    def test_fetchAndSummarize_process(self):
+        with lxbr.newProcessPool(1, lxbr.initCpuWorker) as pool:
+            summary, _ = pool.submit(lxbr.summarizeText,
+                "Linux rocks. Linux kernel rocks. It is.").result()
+            # only the error of the download comes back
+            fetched = pool.submit(lxbr.fetchAndSummarize, "http://127.0.0.1:9/", 1024).result()
+        self.assertEqual(summary, "Linux kernel rocks. Linux rocks. It is.")
+        self.assertIn('error', fetched)
+
+    def test_ArticleCache(self):
+        html = b"<html><body><article><p>Linux news</p></article><img src='/tux.png'></body></html>"
+        bot = self.newBot()
+        responses = []
+
+        def fake_get(url, timeout, stream, headers):
+            status, response_headers = responses.pop(0)
+            response = mock.MagicMock(status_code=status, headers=response_headers)
+            response.__enter__.return_value = response
+            response.iter_content.return_value = iter([html] if status == 200 else [])
+            fake_get.headers = headers
+            return response
+
+        session = mock.Mock()
+        session.get.side_effect = fake_get
+        url = "https://site.org/news/1"
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            responses.append((200, {'content-type': 'text/html', 'ETag': '"v1"',
+                'Cache-Control': 'max-age=0'}))
+            first = bot.get_article_content_and_image(url)
+            # expired: revalidated
+            responses.append((304, {'Cache-Control': 'max-age=600'}))
+            self.assertEqual(bot.get_article_content_and_image(url), first)
+            self.assertEqual(fake_get.headers, {'If-None-Match': '"v1"'})
+            # fresh: not even revalidated
+            self.assertEqual(bot.get_article_content_and_image(url), first)
+        self.assertEqual(first, ("\nLinux news", ["https://site.org/tux.png"]))
+        self.assertEqual(session.get.call_count, 2)
+        self.assertEqual(bot.stats.counters['cache_article_revalidated'], 1)
+        self.assertEqual(bot.stats.counters['cache_article_hit'], 1)
+
+        # no-store responses are not cached, the least recently used go first
+        cache = lxbr.ArticleCache(os.path.join(self.tmpdir.name, 'lru.db'), max_bytes=250)
+        self.addCleanup(cache.close)
+        cache.put("https://a.org/", "a" * 100, [], {})
+        cache.put("https://b.org/", "b" * 100, [], {'Cache-Control': 'no-store'})
+        cache.put("https://c.org/", "c" * 100, [], {})
+        cache.get("https://a.org/")
+        cache.put("https://d.org/", "d" * 100, [], {})
+        self.assertIsNone(cache.get("https://b.org/"))
+        self.assertIsNone(cache.get("https://c.org/"))
+        self.assertTrue(cache.get("https://a.org/")['fresh'])
+        self.assertEqual(cache.get("https://d.org/")['text'], "d" * 100)
+
+    def test_ArticleExtractor_images(self):
+        extractor = lxbr.ArticleExtractor("https://site.org/a/")
+        extractor.feed("<img src='data:image/gif;base64,R0lG'><img srcset='x1.jpg 1x, x2.jpg 2x'>")
+        self.assertEqual(extractor.image, "https://site.org/a/x1.jpg")
+        self.assertFalse(extractor.done)
+
+    def test_publishWordPress(self):
+        bot = self.newBot()
+        bot.articles = [
+            article(f'Notícia {index}', f'https://site.org/{index}', content='texto',
+                image=f'https://site.org/{index}.png')
+            for index in range(5)
+        ]
+        bot.articles[1].image = None
+        bot.articles[2].image = 'https://site.org/broken.png'
+        bot.articles[4].image = 'https://site.org/truncated.png'
+
+        def fake_picture(image, url, token):
+            if 'truncated' in image:
+                raise OSError("image file is truncated")
+            return None if 'broken' in image else 7
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(status_code=201, json=lambda: {'id': 42})
+        bot.post_index.add([{'id': 1, 'title': {'rendered': 'Not&#237;cia 3'}}])
+        signature = bot.near_duplicates.signature(" ".join(f"word{index}" for index in range(50)))
+        for art in bot.articles:
+            bot.near_duplicates.hold(art.link, signature)
+        with mock.patch.object(bot, 'syncPostIndex'), \
+            mock.patch.object(bot, 'publishPicture',
+                side_effect=fake_picture), \
+            mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            results = bot.publishWordPress()
+
+        self.assertEqual([ (r['link'], r['status']) for r in results ], [
+            ('https://site.org/1', lxbr.PUBLISH_MISSING_IMAGE),
+            ('https://site.org/3', lxbr.PUBLISH_ALREADY_PUBLISHED),
+            ('https://site.org/0', lxbr.PUBLISH_POSTED),
+            ('https://site.org/2', lxbr.PUBLISH_IMAGE_FAILED),
+            ('https://site.org/4', lxbr.PUBLISH_FAILED),
+        ])
+        self.assertEqual((results[2]['media_id'], results[2]['post_id']), (7, 42))
+        self.assertEqual(session.post.call_args.kwargs['json']['featured_media'], 7)
+        self.assertTrue(bot.seen.is_seen('https://site.org/0'))
+        self.assertFalse(bot.seen.is_seen('https://site.org/2'))
+        # only the signature of the published article is stored
+        self.assertEqual(bot.near_duplicates.connection().execute(
+            "SELECT link FROM signatures").fetchall(), [('https://site.org/0',)])
+
+    def test_syncPostIndex(self):
+        def post(post_id, title, source, modified):
+            return {'id': post_id, 'slug': f'post-{post_id}', 'title': {'rendered': title},
+                'date': modified, 'modified': modified,
+                'content': {'rendered': f'<p>Resumo<br />\nFonte: <a href="{source}">{source}</a></p>'}}
+
+        pages = [
+            ([post(1, 'Linux 7.0 &#8211; &#8220;lan&#231;ado&#8221;', 'https://kernel.org/7', '2026-01-01T10:00:00')],
+                {'X-WP-TotalPages': '2'}),
+            ([post(2, 'Rust', 'https://lwn.net/rust?a=1&amp;utm_source=x', '2026-01-02T10:00:00')],
+                {'X-WP-TotalPages': '2'}),
+            ([], {'X-WP-TotalPages': '0'}),
+        ]
+        def fake_get(url, headers, params, timeout):
+            posts, response_headers = pages.pop(0)
+            return mock.Mock(status_code=200, json=lambda: posts, headers=response_headers)
+
+        session = mock.Mock()
+        session.get.side_effect = fake_get
+        bot = self.newBot()
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            bot.syncPostIndex()
+            bot.syncPostIndex()
+        first, second, third = [ call.kwargs['params'] for call in session.get.call_args_list ]
+        self.assertEqual((first['page'], second['page']), (1, 2))
+        self.assertNotIn('modified_after', first)
+        self.assertEqual(third['modified_after'], '2026-01-02T10:00:00')
+        self.assertIn('content', third['_fields'])
+
+        self.assertTrue(bot.is_article_already_published(
+            article('Linux 7.0 - "lançado"', 'https://other.org/')))
+        self.assertTrue(bot.is_article_already_published(
+            article('Other', 'https://LWN.net/rust/?a=1')))
+        self.assertFalse(bot.is_article_already_published(
+            article('Other', 'https://kernel.org/8')))
+
+    def test_PublishOutbox(self):
+        bot = self.newBot()
+        bot.articles = [article('Notícia', 'https://site.org/1', content='texto', hash='abc',
+            image='https://site.org/1.png')]
+        session = mock.Mock()
+        session.post.side_effect = lxbr.requests.exceptions.ConnectionError("down")
+        with mock.patch.object(bot, 'syncPostIndex'), \
+            mock.patch.object(bot, 'publishPicture', return_value=7), \
+            mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            results = bot.publishWordPress()
+        self.assertEqual(results[0]['status'], lxbr.PUBLISH_QUEUED)
+        # not fetched/summarized/translated again
+        self.assertTrue(bot.seen.is_seen('https://site.org/1'))
+        self.assertEqual(bot.outbox.due(), [])
+        [ post ] = bot.outbox.due(now=lxbr.time.time() + bot.outbox.backoff)
+        self.assertEqual((post['slug'], post['media_id']), ('noticia', 7))
+
+        # second failure: twice the delay
+        session.get.return_value = mock.Mock(status_code=200, json=lambda: [])
+        session.get.return_value.raise_for_status = mock.Mock()
+        with mock.patch.object(bot.outbox, 'due', return_value=[post]), \
+            mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            self.assertEqual(bot.retryOutbox(), [])
+        self.assertEqual(bot.outbox.due(now=lxbr.time.time() + bot.outbox.backoff), [])
+        [ post ] = bot.outbox.due(now=lxbr.time.time() + 2 * bot.outbox.backoff)
+        self.assertEqual(post['attempts'], 2)
+
+        # another article with the same slug is not this post
+        def wp_post(post_id, source):
+            return {'id': post_id, 'content': {'rendered':
+                f'<p>texto</p>\n<p>Fonte: <a href="{source}">{source}</a></p>'}}
+        session.get.return_value = mock.Mock(status_code=200,
+            json=lambda: [wp_post(41, 'https://other.org/1')])
+        with mock.patch.object(bot.outbox, 'due', return_value=[post]), \
+            mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            self.assertEqual(bot.retryOutbox(), [])
+        self.assertEqual(session.post.call_args.kwargs['json']['slug'], 'noticia')
+        post['attempts'] += 1
+
+        # the last attempt created the post after all: not posted twice
+        session.get.return_value = mock.Mock(status_code=200,
+            json=lambda: [wp_post(41, 'https://other.org/1'), wp_post(42, 'https://site.org/1')])
+        session.post.reset_mock()
+        with mock.patch.object(bot.outbox, 'due', return_value=[post]), \
+            mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            [ result ] = bot.retryOutbox()
+        session.post.assert_not_called()
+        self.assertEqual((result['status'], result['post_id']), (lxbr.PUBLISH_POSTED, 42))
+        self.assertEqual(session.get.call_args.kwargs['params']['slug'],
+            'noticia,noticia-2,noticia-3,noticia-4,noticia-5')
+        self.assertEqual(bot.outbox.due(now=lxbr.time.time() + 1e6), [])
+        self.assertEqual(bot.stats.counters['outbox_posted'], 1)
+
+        # a new article with the slug of a posted one is queued, not dropped
+        new = dict(post, link='https://site.org/2', media_id=8)
+        bot.outbox.add(new)
+        bot.outbox.add(dict(post, link='https://site.org/3'))
+        self.assertEqual([ (queued['slug'], queued['link'])
+            for queued in bot.outbox.due(now=lxbr.time.time() + 1e6) ],
+            [('noticia', 'https://site.org/2'), ('noticia-2', 'https://site.org/3')])
+
+    def test_send_post_invalid_media(self):
+        bot = self.newBot()
+        bot.media_index.add('https://site.org/1.png', '0' * 64, 7)
+        post = {'slug': 'noticia', 'title': 'Notícia', 'content': 'texto', 'media_id': 7}
+        session = mock.Mock()
+        # another error: the media is still valid and reused
+        session.post.return_value = mock.Mock(status_code=400,
+            json=lambda: {'code': 'rest_invalid_param'})
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            self.assertIsNone(bot.send_post(post))
+        self.assertEqual((post['media_id'], bot.media_index.by_url('https://site.org/1.png')),
+            (7, 7))
+        # the media was removed from WordPress: uploaded again next time
+        session.post.return_value = mock.Mock(status_code=400,
+            json=lambda: {'code': 'rest_invalid_featured_media'})
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            self.assertIsNone(bot.send_post(post))
+        self.assertEqual((post['media_id'], bot.media_index.by_url('https://site.org/1.png')),
+            (None, None))
+
+    def test_generateAlias(self):
+        self.assertEqual(self.bot.generateAlias("Linux 6.8 lançado, com novidades: Rust e mais"),
+            "linux-6-8-lancado-com-novidades-rust-e-mais")
+        self.assertEqual(self.bot.generateAlias(" Über-fast  C++ & Go — 100% "),
+            "uber-fast-c-go-100")
+
+    def imageResponse(self, body, headers):
+        response = mock.MagicMock(status_code=200, headers=headers)
+        response.__enter__.return_value = response
+        response.iter_content.return_value = iter(
+            [ body[index:index + 1000] for index in range(0, len(body), 1000) ])
+        return response
+
+    def test_publishPicture(self):
+        gif = b"GIF89a" + bytes(range(256)) * 40
+        digest = lxbr.hashlib.sha256(gif).hexdigest()
+        bot = self.newBot()
+        uploaded = {}
+
+        def fake_post(url, headers, data, timeout):
+            uploaded['headers'] = headers
+            uploaded['size'] = len(data)
+            uploaded['body'] = data
+            return mock.Mock(status_code=201, json=lambda: {'id': 12})
+
+        session = mock.Mock()
+        session.get.return_value = self.imageResponse(gif, {'content-length': str(len(gif))})
+        session.post.side_effect = fake_post
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            media_id = bot.publishPicture("https://site.org/img/logo?size=2",
+                "https://linux-br.org", "token")
+        self.assertEqual(media_id, 12)
+        self.assertEqual(uploaded['body'], gif)
+        self.assertEqual(uploaded['size'], len(gif))
+        self.assertEqual(uploaded['headers']['Content-type'], 'image/gif')
+        self.assertEqual(uploaded['headers']['Content-Disposition'],
+            f'attachment; filename=logo-{digest[:16]}.gif')
+
+        # same url: not even downloaded, same content: not uploaded
+        session.get.return_value = self.imageResponse(gif, {})
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            self.assertEqual(bot.publishPicture("https://site.org/img/logo?size=2",
+                "https://linux-br.org", "token"), 12)
+            self.assertEqual(session.get.call_count, 1)
+            self.assertEqual(bot.publishPicture("https://other.org/copy.gif",
+                "https://linux-br.org", "token"), 12)
+        self.assertEqual(session.post.call_count, 1)
+
+        bot.images['max_bytes'] = 1000
+        session.get.return_value = self.imageResponse(gif, {})
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            self.assertIsNone(bot.publishPicture("https://site.org/img/big.gif",
+                "https://linux-br.org", "token"))
+
+    def test_rebuildMediaIndex(self):
+        bot = self.newBot()
+        bot.media_index = lxbr.MediaIndex(os.path.join(self.tmpdir.name, 'new_media.db'))
+        self.addCleanup(bot.media_index.close)
+        session = mock.Mock()
+        # failed rebuilds are tried again, even from another process
+        for failure in (requests.exceptions.RetryError("too many 503 responses"),
+                mock.Mock(status_code=403, headers={}, json=lambda: {'code': 'rest_forbidden'})):
+            session.get.side_effect = [ failure ]
+            with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+                bot.rebuildMediaIndex()
+            self.assertIsNone(bot.media_index.by_url('https://site.org/logo.png'))
+            self.assertFalse(lxbr.MediaIndex(bot.media_index.path).is_rebuilt())
+
+        pages = [
+            mock.Mock(status_code=200, headers={'X-WP-TotalPages': '2'}, json=lambda: [
+                {'id': 3, 'source_url': 'https://linux-br.org/uploads/logo-0123456789abcdef-1.png'},
+                {'id': 4, 'source_url': 'https://linux-br.org/uploads/manual-upload.png'}]),
+            mock.Mock(status_code=200, headers={'X-WP-TotalPages': '2'}, json=lambda: [
+                {'id': 5, 'source_url': 'https://linux-br.org/uploads/hero-fedcba9876543210-scaled.jpg'}]),
+        ]
+        session.get.side_effect = pages
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            bot.rebuildMediaIndex()
+        self.assertEqual(bot.media_index.by_hash('0123456789abcdef'), 3)
+        self.assertEqual(bot.media_index.by_hash('fedcba9876543210' + '0' * 48), 5)
+        index = lxbr.MediaIndex(bot.media_index.path)
+        self.assertTrue(index.is_rebuilt())
+        index.close()
+
+    def test_publishPicture_concurrent(self):
+        gif = b"GIF89a" + bytes(range(256)) * 40
+        bot = self.newBot()
+
+        def slow_post(url, headers, data, timeout):
+            time.sleep(0.05)
+            return mock.Mock(status_code=201, json=lambda: {'id': 12})
+
+        session = mock.Mock()
+        session.get.side_effect = lambda link, **kwargs: self.imageResponse(gif, {})
+        session.post.side_effect = slow_post
+        # the same hero image for every article, by the same or another url
+        links = [ "https://site.org/hero.gif" ] * 4 + [
+            f"https://mirror{index}.org/hero.gif" for index in range(4) ]
+        with mock.patch.object(lxbr, 'get_http_session', return_value=session), \
+            ThreadPoolExecutor(max_workers=8) as executor:
+            media_ids = list(executor.map(lambda link: bot.publishPicture(link,
+                "https://linux-br.org", "token"), links))
+        self.assertEqual(media_ids, [12] * 8)
+        self.assertEqual(session.post.call_count, 1)
+        self.assertEqual(bot.media_index.uploads, {})
+
+    @unittest.skipUnless(importlib.util.find_spec('PIL'), "Pillow not installed")
+    def test_processImage(self):
+        from PIL import Image # pylint: disable=C0415
+        def png(width, height):
+            output = io.BytesIO()
+            Image.new('RGB', (width, height), (200, 30, 30)).save(output, format='PNG')
+            return output.getvalue()
+
+        bot = self.newBot()
+        self.addCleanup(bot.stopImagePool)
+        big = png(2400, 1200)
+        image = bot.processImage(lxbr.DownloadedImage("https://site.org/big.png", "image/png",
+            big))
+        self.assertEqual(image.image_type, "image/webp")
+        self.assertEqual(Image.open(io.BytesIO(image.data)).size, (1200, 600))
+
+        pixel = png(1, 1)
+        self.assertIsNone(bot.processImage(lxbr.DownloadedImage("https://site.org/pixel.png",
+            "image/png", pixel)))
+        truncated = big[:len(big) // 2]
+        self.assertEqual(lxbr.transcodeImage(truncated, "image/png", 1200, 100, "WEBP", 80),
+            (truncated, "image/png"))
+        svg = b"<svg xmlns='http://www.w3.org/2000/svg'/>"
+        self.assertEqual(lxbr.transcodeImage(svg, "image/svg+xml", 1200, 100, "WEBP", 80),
+            (svg, "image/svg+xml"))
+
+    def test_NewsDaemon(self):
+        config = os.path.join(self.tmpdir.name, 'bot.config')
+        interests = os.path.join(self.tmpdir.name, 'interests.list')
+        with open("dot.config", encoding="utf-8") as src, open(config, "w", encoding="utf-8") as dst:
+            dst.write(src.read().replace("~/.cache/linux-br.org-news-bot", self.tmpdir.name)
+                .replace("INTERVAL = 60", "INTERVAL = 0").replace("JITTER = 10", "JITTER = 0"))
+        with open(interests, "w", encoding="utf-8") as dst:
+            dst.write("Linux\n")
+        self.addCleanup(lxbr.get_interested_terms)
+
+        runs = []
+        bots = []
+        def fake_run(bot):
+            runs.append(list(lxbr.INTERESTED_TERMS))
+            bots.append(bot)
+            if len(runs) == 1:
+                with open(interests, "w", encoding="utf-8") as dst:
+                    dst.write("Linux\nRust\n")
+                os.utime(interests, (time.time() + 10, time.time() + 10))
+            if len(runs) == 2:
+                # half written files: the current ones are kept
+                with open(interests, "w", encoding="utf-8") as dst:
+                    dst.write("Linux\n(Rust\n")
+                os.utime(interests, (time.time() + 20, time.time() + 20))
+                with open(config, "w", encoding="utf-8") as dst:
+                    dst.write("[WORDPRESS\n")
+                os.utime(config, (time.time() + 20, time.time() + 20))
+            if len(runs) == 3:
+                daemon.stop()
+
+        with mock.patch.object(lxbr, 'INTERESTED_TERMS_FILE', interests), \
+            mock.patch.object(lxbr.NewsBot, 'run', autospec=True, side_effect=fake_run), \
+            mock.patch.object(lxbr.signal, 'signal'):
+            daemon = lxbr.NewsDaemon(config)
+            daemon.run()
+        self.assertEqual(runs, [["Linux"], ["Linux", "Rust"], ["Linux", "Rust"]])
+        self.assertEqual(lxbr.INTEREST_MATCHER.match("I love rust code"), ["Rust"])
+        self.assertIs(bots[2], bots[0])
+
+    def test_run_telemetry(self):
+        bot = self.newBot()
+        bot.feed_cache = lxbr.FeedCache(os.path.join(self.tmpdir.name, 'feeds.json'))
+        bot.telemetry = {
+            'json': os.path.join(self.tmpdir.name, 'report.json'),
+            'prometheus': os.path.join(self.tmpdir.name, 'newsbot.prom'),
+        }
+        entries = [
+            {'title': 'Linux 7.0 released', 'link': 'https://kernel.org/7'},
+            {'title': 'Rust in the kernel', 'link': 'https://lwn.net/rust'},
+            {'title': 'Smart Lasers for Bone Surgery', 'link': 'https://lasers.com/'},
+        ]
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(status_code=201, json=lambda: {'id': 1})
+        with mock.patch.object(bot.feed_cache, 'fetch', return_value=(entries, True)), \
+            mock.patch.object(bot, 'get_article_content_and_image', side_effect=[
+                ("A long enough text", ["https://kernel.org/tux.png"]), ("Rust text", [])]), \
+            mock.patch.object(bot, 'generate_summary', side_effect=lambda text: text), \
+            mock.patch.object(bot, 'syncPostIndex'), \
+            mock.patch.object(bot, 'publishPicture', return_value=7), \
+            mock.patch.object(lxbr, 'get_http_session', return_value=session):
+            bot.run()
+
+        with open(bot.telemetry['json'], encoding="utf-8") as src:
+            report = lxbr.json.load(src)
+        self.assertEqual(report['counters']['discard_not_interesting'], 1)
+        self.assertEqual(report['counters']['discard_no_image'], 1)
+        self.assertEqual(report['counters']['publish_posted'], 1)
+        self.assertEqual(report['phases']['summarize']['calls'], 2)
+        self.assertIn('translate', report['phases'])
+        with open(bot.telemetry['prometheus'], encoding="utf-8") as src:
+            prometheus = src.read()
+        self.assertIn('newsbot_events{event="publish_posted"} 1\n', prometheus)
+        self.assertIn('newsbot_phase_calls{phase="feed"} 1\n', prometheus)
+
 if __name__ == '__main__':
     unittest.main()
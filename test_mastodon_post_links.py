@@ -0,0 +1,146 @@
+#! /usr/bin/env python3
+import unittest
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import types
+from unittest import mock
+
+sys.dont_write_bytecode = True
+
+class MastodonError(Exception):
+    'Stub of mastodon.MastodonError'
+
+class StubMastodon:
+    'Offline Mastodon account, recording the toots'
+    toots = {}
+    failures = {}
+
+    def __init__(self, access_token, api_base_url, ratelimit_method):
+        self.userid = access_token
+        self.toots.setdefault(self.userid, [])
+
+    def me(self):
+        return {'acct': self.userid}
+
+    def status_post(self, text):
+        failure = self.failures.get(self.userid)
+        if failure is not None:
+            raise failure
+        self.toots[self.userid].append(text)
+
+def load_script():
+    'mastodon-post-links.py as a module, with the Mastodon stub'
+    stub = types.ModuleType('mastodon')
+    stub.Mastodon = StubMastodon
+    stub.MastodonError = MastodonError
+    with mock.patch.dict(sys.modules, {'mastodon': stub}):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mastodon-post-links.py')
+        spec = importlib.util.spec_from_file_location('mastodon_post_links', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+mpl = load_script()
+
+class TestMastodonPostLinks(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.database = os.path.join(self.tmpdir.name, 'posts.db')
+        config = os.path.join(self.tmpdir.name, 'config.json')
+        with open(config, 'w', encoding='utf-8') as dst:
+            json.dump({'users': {
+                userid: {'access_token': userid, 'instance': 'https://mastodon.social'}
+                for userid in ('alice', 'bob') }}, dst)
+        patcher = mock.patch.object(mpl, 'CONFIG', config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        StubMastodon.toots.clear()
+        StubMastodon.failures.clear()
+
+    def newToot(self):
+        return mpl.TootPostLink(['alice', 'bob'], self.database)
+
+    def queued(self, status):
+        with sqlite3.connect(self.database) as con:
+            return sorted(con.execute("SELECT account, link FROM post_queue WHERE status = ?",
+                (status,)).fetchall())
+
+    def test_queue_survives_crash(self):
+        toot = self.newToot()
+        # newest first, as in the feed
+        toot.articles = [ [f'News {index}', f'https://linux-br.org/{index}']
+            for index in (3, 2, 1) ]
+        toot.queueArticles()
+
+        # alice's run stops after her first toot
+        posted = []
+        def crash(text):
+            if posted:
+                raise KeyboardInterrupt()
+            posted.append(text)
+        with mock.patch.object(StubMastodon, 'status_post', side_effect=crash):
+            with self.assertRaises(KeyboardInterrupt):
+                toot.postAccount('alice')
+        self.assertEqual(posted, [mpl.tootText('News 1', 'https://linux-br.org/1')])
+
+        toot = self.newToot()
+        with sqlite3.connect(self.database) as con:
+            self.assertTrue(toot.isPosted(con, 'https://linux-br.org/2'))
+        toot.postMastodon()
+        self.assertEqual(StubMastodon.toots['alice'],
+            [ mpl.tootText(f'News {index}', f'https://linux-br.org/{index}') for index in (2, 3) ])
+        self.assertEqual(StubMastodon.toots['bob'],
+            [ mpl.tootText(f'News {index}', f'https://linux-br.org/{index}') for index in (1, 2, 3) ])
+        self.assertEqual(len(self.queued(mpl.QUEUE_POSTED)), 6)
+
+        # nothing left to post
+        toot.postMastodon()
+        self.assertEqual(len(StubMastodon.toots['alice']), 2)
+
+    def test_failed_toot_backoff(self):
+        toot = self.newToot()
+        toot.articles = [ ['News', 'https://linux-br.org/news'] ]
+        toot.queueArticles()
+        StubMastodon.failures['alice'] = MastodonError('500 server error')
+        toot.postMastodon()
+        self.assertEqual(self.queued(mpl.QUEUE_POSTED), [('bob', 'https://linux-br.org/news')])
+
+        # not tried again before the backoff
+        toot.postMastodon()
+        with sqlite3.connect(self.database) as con:
+            self.assertEqual(con.execute("SELECT attempts FROM post_queue " +
+                "WHERE account = 'alice'").fetchone(), (1,))
+
+        for _ in range(mpl.POST_MAX_ATTEMPTS - 1):
+            with sqlite3.connect(self.database) as con:
+                con.execute("UPDATE post_queue SET retry_at = 0")
+            toot.postMastodon()
+        self.assertEqual(self.queued(mpl.QUEUE_ABANDONED), [('alice', 'https://linux-br.org/news')])
+        self.assertEqual(StubMastodon.toots['alice'], [])
+
+    def test_getDataDB_removes_duplicates(self):
+        with sqlite3.connect(self.database) as con:
+            con.execute("CREATE TABLE posted_articles (link TEXT)")
+            con.executemany("INSERT INTO posted_articles VALUES (?)", [ (link,) for link in
+                ('https://linux-br.org/a', 'https://linux-br.org/b', 'https://linux-br.org/a',
+                'https://linux-br.org/a', 'https://linux-br.org/b', 'https://linux-br.org/c') ])
+        self.newToot()
+        with sqlite3.connect(self.database) as con:
+            self.assertEqual(sorted(con.execute("SELECT link FROM posted_articles")), [
+                ('https://linux-br.org/a',), ('https://linux-br.org/b',), ('https://linux-br.org/c',)])
+            index = con.execute("SELECT sql FROM sqlite_master WHERE type = 'index' " +
+                "AND name = 'posted_articles_link'").fetchone()
+            self.assertIn('UNIQUE', index[0])
+            with self.assertRaises(sqlite3.IntegrityError):
+                con.execute("INSERT INTO posted_articles VALUES ('https://linux-br.org/a')")
+        # the cleanup is only done once
+        self.newToot()
+
+
+if __name__ == '__main__':
+    unittest.main()